@@ -0,0 +1,86 @@
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from core.testing import QueryBudgetMixin
+from posts.models import Comment, Group, Post, User
+
+
+class ApiTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        cls.posts = [
+            Post.objects.create(
+                author=cls.user, group=cls.group, text=f'Пост {number}'
+            )
+            for number in range(3)
+        ]
+        Comment.objects.create(
+            post=cls.posts[0], author=cls.user, text='Комментарий'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_cursor_and_fields(self):
+        """Лента отдаётся по курсору и только с запрошенными полями."""
+        url = reverse('api:posts')
+        first = self.client.get(url, {'limit': 2, 'fields': 'id,author'})
+        self.assertEqual(first.json()['results'], [
+            {'id': self.posts[2].pk, 'author': 'auth'},
+            {'id': self.posts[1].pk, 'author': 'auth'},
+        ])
+        second = self.client.get(url, {
+            'limit': 2, 'fields': 'text', 'after': first.json()['next']
+        })
+        self.assertEqual(
+            second.json(), {'results': [{'text': 'Пост 0'}], 'next': None}
+        )
+        self.assertEqual(
+            self.client.get(url, {'fields': 'password'}).status_code, 400
+        )
+
+    def test_endpoints(self):
+        """Группа, профиль, пост и комментарии отдают те же данные,
+        что и HTML-страницы."""
+        post = self.posts[0]
+        responses = {
+            reverse('api:group', args=('group',)): 3,
+            reverse('api:profile', args=('auth',)): 3,
+            reverse('api:post_comments', args=(post.pk,)): 1,
+        }
+        for url, count in responses.items():
+            with self.subTest(url=url):
+                self.assertEqual(
+                    len(self.client.get(url).json()['results']), count
+                )
+                self.assertWithinQueryBudget(self.client, url)
+        detail = self.client.get(reverse('api:post_detail', args=(post.pk,)))
+        self.assertEqual(detail.json()['group'], 'group')
+        self.assertEqual(detail.json()['comments_count'], 1)
+        self.assertEqual(
+            self.client.get(reverse('api:group', args=('nope',))).status_code,
+            404
+        )
+
+    def test_not_modified(self):
+        """Повторный запрос с ETag получает 304 без запросов к базе,
+        новый комментарий меняет ETag."""
+        url = reverse('api:post_detail', args=(self.posts[0].pk,))
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Comment.objects.create(
+            post=self.posts[0], author=self.user, text='Ещё один'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['comments_count'], 2)
@@ -0,0 +1,205 @@
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import JsonResponse
+from django.views.decorators.http import condition, require_GET
+
+from core.decorators import query_budget
+from core.generations import get_generations
+from posts.models import Comment, Group, Post, User
+from posts.utils import decode_cursor, encode_key, seek_queryset
+
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+    'comments_count': 'comments_count',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'author': 'author__username',
+    'text': 'text',
+    'created': 'created',
+}
+MAX_LIMIT = 100
+# Любая правка поста, группы или автора сменяет index_page,
+# новый или удалённый комментарий - comments.
+GENERATIONS = ('index_page', 'comments')
+
+
+class ApiError(Exception):
+    pass
+
+
+def error(message, status=400):
+    return JsonResponse(
+        {'error': message}, status=status,
+        json_dumps_params={'ensure_ascii': False}
+    )
+
+
+def _generations(request):
+    if not hasattr(request, '_api_generations'):
+        request._api_generations = get_generations(GENERATIONS)
+    return request._api_generations
+
+
+def _etag(request, *args, **kwargs):
+    return 'v1-' + '-'.join(
+        str(generation) for generation, _ in _generations(request).values()
+    )
+
+
+def _last_modified(request, *args, **kwargs):
+    changed = max(changed for _, changed in _generations(request).values())
+    return datetime.fromtimestamp(changed, timezone.utc)
+
+
+def api_view(queries):
+    """GET-представление API: ответ 304 по ETag и Last-Modified
+    отдаётся по поколениям из кэша, без запросов к базе.
+    Ошибки запроса возвращаются как JSON с кодом 400.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as exception:
+                return error(str(exception))
+        conditional = condition(
+            etag_func=_etag, last_modified_func=_last_modified
+        )(wrapper)
+        return query_budget(queries)(require_GET(conditional))
+    return decorator
+
+
+def selected_fields(request, fields):
+    """Поля из ?fields=a,b или все поля."""
+    requested = request.GET.get('fields')
+    if not requested:
+        return fields
+    names = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = set(names) - fields.keys()
+    if unknown:
+        raise ApiError(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+    return {name: fields[name] for name in names}
+
+
+def page_limit(request):
+    try:
+        limit = int(request.GET.get('limit', settings.NUMBER__OF_POSTS))
+    except ValueError:
+        raise ApiError('limit должен быть числом')
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def page_key(request):
+    after = request.GET.get('after')
+    if not after:
+        return None
+    key = decode_cursor(after)
+    if key is None:
+        raise ApiError('Неверный курсор')
+    return key
+
+
+def serialize(row, fields):
+    """Строка values() в словарь ответа, без экземпляров моделей."""
+    data = {name: row[path] for name, path in fields.items()}
+    if 'image' in data:
+        data['image'] = (
+            Post.image.field.storage.url(data['image'])
+            if data['image'] else None
+        )
+    return data
+
+
+def respond(data):
+    return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+
+
+def post_page(request, queryset):
+    fields = selected_fields(request, POST_FIELDS)
+    limit = page_limit(request)
+    rows = list(seek_queryset(
+        queryset.values(*{*fields.values(), 'id', 'pub_date'}),
+        page_key(request)
+    )[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return respond({
+        'results': [serialize(row, fields) for row in rows],
+        'next': (
+            encode_key(rows[-1]['pub_date'], rows[-1]['id'])
+            if has_more else None
+        ),
+    })
+
+
+@api_view(1)
+def posts(request):
+    """Лента всех постов, новые первыми."""
+    return post_page(request, Post.objects.all())
+
+
+@api_view(2)
+def group_posts(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'id', flat=True
+    ).first()
+    if group_id is None:
+        return error('Группа не найдена', 404)
+    return post_page(request, Post.objects.filter(group_id=group_id))
+
+
+@api_view(2)
+def profile_posts(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'id', flat=True
+    ).first()
+    if author_id is None:
+        return error('Пользователь не найден', 404)
+    return post_page(request, Post.objects.filter(author_id=author_id))
+
+
+@api_view(1)
+def post_detail(request, post_id):
+    fields = selected_fields(request, POST_FIELDS)
+    row = Post.objects.filter(pk=post_id).values(*fields.values()).first()
+    if row is None:
+        return error('Пост не найден', 404)
+    return respond(serialize(row, fields))
+
+
+@api_view(2)
+def post_comments(request, post_id):
+    """Комментарии поста от старых к новым."""
+    fields = selected_fields(request, COMMENT_FIELDS)
+    limit = page_limit(request)
+    comments = Comment.objects.filter(post_id=post_id)
+    key = page_key(request)
+    if key is not None:
+        created, pk = key
+        comments = comments.filter(
+            Q(created__gt=created) | Q(created=created, id__gt=pk)
+        )
+    rows = list(comments.order_by('created', 'id').values(
+        *{*fields.values(), 'id', 'created'}
+    )[:limit + 1])
+    if not rows and not Post.objects.filter(pk=post_id).exists():
+        return error('Пост не найден', 404)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return respond({
+        'results': [serialize(row, fields) for row in rows],
+        'next': (
+            encode_key(rows[-1]['created'], rows[-1]['id'])
+            if has_more else None
+        ),
+    })
@@ -0,0 +1,456 @@
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+SQLITE_MAX_VARIABLES = 500
+
+
+def _dumps(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _chunks(items, size=SQLITE_MAX_VARIABLES):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteCache(BaseCache):
+    """Общий для всех процессов кэш в файле SQLite.
+    Локальная замена memcached или redis: в продакшене
+    вместо него подключается сетевой бэкенд.
+    """
+    cull_every = 100
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+        self._writes = 0
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+            )
+            self._local.db = db
+        return db
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _select(self, keys):
+        values = {}
+        for chunk in _chunks(keys):
+            rows = self._db.execute(
+                'SELECT key, value FROM cache WHERE key IN ({}) '
+                'AND (expires IS NULL OR expires > ?)'.format(
+                    ','.join('?' * len(chunk))
+                ),
+                (*chunk, time.time())
+            )
+            values.update((key, pickle.loads(value)) for key, value in rows)
+        return values
+
+    def _cull(self):
+        self._writes += 1
+        if self._writes % self.cull_every:
+            return
+        db = self._db
+        db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        count = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries:
+            db.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency,)
+            )
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._select([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        made = {self._key(key, version): key for key in keys}
+        return {
+            made[key]: value for key, value in self._select(made).items()
+        }
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._db.execute(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+            (
+                self._key(key, version),
+                _dumps(value),
+                self.get_backend_timeout(timeout)
+            )
+        )
+        self._cull()
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        # Значения сериализуются до начала транзакции.
+        rows = [
+            (self._key(key, version), _dumps(value), expires)
+            for key, value in data.items()
+        ]
+        db = self._db
+        db.execute('BEGIN')
+        try:
+            db.executemany(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', rows
+            )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        self._cull()
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        value = _dumps(value)
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (key, time.time())
+            )
+            added = db.execute(
+                'INSERT OR IGNORE INTO cache VALUES (?, ?, ?)',
+                (key, value, self.get_backend_timeout(timeout))
+            ).rowcount == 1
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        if added:
+            self._cull()
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._db.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (
+                self.get_backend_timeout(timeout),
+                self._key(key, version),
+                time.time()
+            )
+        ).rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, time.time())
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            db.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (_dumps(value), key)
+            )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return value
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return key in self._select([key])
+
+    def delete(self, key, version=None):
+        self._db.execute(
+            'DELETE FROM cache WHERE key = ?', (self._key(key, version),)
+        )
+
+    def delete_many(self, keys, version=None):
+        for chunk in _chunks(self._key(key, version) for key in keys):
+            self._db.execute(
+                'DELETE FROM cache WHERE key IN ({})'.format(
+                    ','.join('?' * len(chunk))
+                ),
+                chunk
+            )
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+
+class CacheBroadcast:
+    """Рассылка инвалидаций L1 между процессами.
+    Журнал удалённых ключей хранится в самом общем кэше,
+    поэтому рассылка работает с любым сетевым бэкендом.
+    """
+    seq_key = 'l1:seq'
+    max_backlog = 1000
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.source = uuid.uuid4().hex
+        self.seen = None
+
+    def _entry_key(self, seq):
+        return f'l1:invalidated:{seq}'
+
+    def publish(self, shared, keys):
+        """Сообщает остальным процессам ключи, устаревшие в L1.
+        keys=None означает очистку L1 целиком.
+        """
+        shared.add(self.seq_key, 0, None)
+        seq = shared.incr(self.seq_key)
+        shared.set(self._entry_key(seq), (self.source, keys), self.ttl)
+
+    def poll(self, shared):
+        """Ключи, которые нужно убрать из L1 этого процесса.
+        None - журнал потерян или очищен, надёжнее сбросить L1 целиком.
+        """
+        seq = shared.get(self.seq_key, 0)
+        seen, self.seen = self.seen, seq
+        if seen is None or seq == seen:
+            return []
+        if seq < seen or seq - seen > self.max_backlog:
+            return None
+        entries = shared.get_many(
+            [self._entry_key(number) for number in range(seen + 1, seq + 1)]
+        )
+        if len(entries) < seq - seen:
+            return None
+        keys = []
+        for source, entry_keys in entries.values():
+            if entry_keys is None:
+                return None
+            if source != self.source:
+                keys.extend(entry_keys)
+        return keys
+
+
+class LRUStore:
+    """Кэш первого уровня в памяти процесса,
+    ограниченный суммарным размером значений в байтах.
+    """
+
+    def __init__(self, max_bytes, broadcast):
+        self.max_bytes = max_bytes
+        self.broadcast = broadcast
+        self.polled_at = 0
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, blob = entry
+            if expires <= time.time():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return blob
+
+    def set(self, key, blob, expires):
+        with self._lock:
+            self._pop(key)
+            if len(blob) > self.max_bytes:
+                return
+            self._data[key] = (expires, blob)
+            self.size += len(blob)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, keys):
+        with self._lock:
+            for key in keys:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+_missing = object()
+
+
+class TwoTierCache(BaseCache):
+    """Двухуровневый кэш: LRU в памяти процесса (L1)
+    поверх общего для процессов кэша (L2).
+    LOCATION - алиас L2 в settings.CACHES. Запись идёт в оба уровня,
+    а остальные процессы узнают об изменениях через рассылку
+    и не держат значение в L1 дольше L1_TIMEOUT секунд.
+    Ключи с префиксами из SHARED_ONLY_PREFIXES, например счётчики
+    метрик, которые меняются на каждом запросе, живут только в L2
+    и не попадают в рассылку.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location
+        self._l1_timeout = options.get('L1_TIMEOUT', 5)
+        self._poll_interval = options.get('POLL_INTERVAL', 0.5)
+        self._shared_only = tuple(options.get('SHARED_ONLY_PREFIXES', ()))
+        broadcast = import_string(
+            options.get('BROADCAST', 'core.cache.CacheBroadcast')
+        )
+        with _stores_lock:
+            if location not in _stores:
+                _stores[location] = LRUStore(
+                    options.get('L1_MAX_BYTES', 16 * 1024 * 1024),
+                    broadcast()
+                )
+            self._l1 = _stores[location]
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _sync(self):
+        now = time.time()
+        if now - self._l1.polled_at < self._poll_interval:
+            return
+        self._l1.polled_at = now
+        keys = self._l1.broadcast.poll(self.shared)
+        if keys is None:
+            self._l1.clear()
+        else:
+            self._l1.discard(keys)
+
+    def _remember(self, key, value):
+        self._l1.set(key, _dumps(value), time.time() + self._l1_timeout)
+
+    def _invalidate(self, keys):
+        self._l1.discard(keys)
+        self._l1.broadcast.publish(self.shared, keys)
+
+    def _is_shared_only(self, key):
+        return bool(self._shared_only) and key.startswith(self._shared_only)
+
+    def _split(self, keys):
+        tiered, shared_only = [], []
+        for key in keys:
+            (shared_only if self._is_shared_only(key) else tiered).append(key)
+        return tiered, shared_only
+
+    def get(self, key, default=None, version=None):
+        if self._is_shared_only(key):
+            return self.shared.get(key, default, version=version)
+        self._sync()
+        made_key = self._key(key, version)
+        blob = self._l1.get(made_key)
+        if blob is not None:
+            return pickle.loads(blob)
+        value = self.shared.get(key, _missing, version=version)
+        if value is _missing:
+            return default
+        self._remember(made_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys, missing = self._split(keys)
+        values = {}
+        if keys:
+            self._sync()
+        for key in keys:
+            blob = self._l1.get(self._key(key, version))
+            if blob is None:
+                missing.append(key)
+            else:
+                values[key] = pickle.loads(blob)
+        if missing:
+            shared = self.shared.get_many(missing, version=version)
+            for key, value in shared.items():
+                if not self._is_shared_only(key):
+                    self._remember(self._key(key, version), value)
+            values.update(shared)
+        return values
+
+    def has_key(self, key, version=None):
+        if self._is_shared_only(key):
+            return self.shared.has_key(key, version=version)
+        self._sync()
+        if self._l1.get(self._key(key, version)) is not None:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if not self._is_shared_only(key):
+            self._invalidate([self._key(key, version)])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        keys, _ = self._split(data)
+        if keys:
+            self._invalidate([self._key(key, version) for key in keys])
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and not self._is_shared_only(key):
+            self._invalidate([self._key(key, version)])
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        if not self._is_shared_only(key):
+            self._invalidate([self._key(key, version)])
+        return value
+
+    def delete(self, key, version=None):
+        self.shared.delete(key, version=version)
+        if not self._is_shared_only(key):
+            self._invalidate([self._key(key, version)])
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.shared.delete_many(keys, version=version)
+        keys, _ = self._split(keys)
+        if keys:
+            self._invalidate([self._key(key, version) for key in keys])
+
+    def clear(self):
+        self.shared.clear()
+        self._l1.clear()
+        self._l1.broadcast.publish(self.shared, None)
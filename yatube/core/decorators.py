@@ -0,0 +1,8 @@
+def query_budget(queries):
+    """Объявляет, сколько SQL-запросов может сделать view.
+    Бюджет проверяется в тестах через core.testing.QueryBudgetMixin.
+    """
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
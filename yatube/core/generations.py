@@ -0,0 +1,71 @@
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.views.decorators.cache import cache_page
+
+
+def _key(name):
+    return f'generation:{name}'
+
+
+def _changed_key(name):
+    return f'generation:{name}:changed'
+
+
+def _new_generation():
+    # После вытеснения ключа поколение не должно повториться.
+    return int(time.time() * 1000)
+
+
+def get_generation(name):
+    generation = cache.get(_key(name))
+    if generation is None:
+        cache.add(_key(name), _new_generation(), None)
+        cache.add(_changed_key(name), time.time(), None)
+        generation = cache.get(_key(name))
+    return generation
+
+
+def get_generations(names):
+    """Поколения и время их последней смены одним get_many:
+    {имя: (поколение, unix-время)}.
+    """
+    keys = {_key(name): name for name in names}
+    keys.update({_changed_key(name): name for name in names})
+    values = cache.get_many(keys)
+    result = {}
+    for name in names:
+        generation = values.get(_key(name))
+        if generation is None:
+            generation = get_generation(name)
+        changed = values.get(_changed_key(name))
+        if changed is None:
+            # Время смены вытеснено: считаем, что всё изменилось сейчас.
+            changed = time.time()
+            cache.add(_changed_key(name), changed, None)
+        result[name] = (generation, changed)
+    return result
+
+
+def bump_generation(name):
+    """Делает устаревшими все страницы, закэшированные под этим именем."""
+    try:
+        cache.incr(_key(name))
+    except ValueError:
+        cache.set(_key(name), _new_generation(), None)
+    cache.set(_changed_key(name), time.time(), None)
+
+
+def cache_page_by_generation(timeout, name):
+    """Как cache_page, но номер поколения входит в ключ кэша.
+    Страницу можно хранить долго: bump_generation сразу её сбрасывает.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            prefix = f'{name}:{get_generation(name)}'
+            cached_view = cache_page(timeout, key_prefix=prefix)(view)
+            return cached_view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import tasks
+
+
+class Command(BaseCommand):
+    help = 'Запускает обработчики очереди задач и планировщик.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.TASK_WORKERS,
+            help='Число процессов-обработчиков.'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1,
+            help='Пауза в секундах, когда очередь пуста.'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить готовые задачи в этом процессе и выйти.'
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            tasks.release_stale()
+            tasks.purge_done()
+            tasks.schedule()
+            done = 0
+            while tasks.run_next('once'):
+                done += 1
+            self.stdout.write(f'Выполнено задач: {done}')
+            return
+        self.stdout.write(
+            f'Обработчиков: {options["workers"]}, остановка - Ctrl+C'
+        )
+        tasks.run_workers(options['workers'], options['poll_interval'])
@@ -0,0 +1,34 @@
+from django.core.cache import cache
+
+NAMES_KEY = 'metrics:names'
+
+
+def _key(name):
+    return f'metrics:{name}'
+
+
+def _register(name):
+    names = cache.get(NAMES_KEY, set())
+    if name not in names:
+        cache.set(NAMES_KEY, names | {name}, None)
+
+
+def incr(name, delta=1):
+    """Увеличивает общий для всех процессов счётчик."""
+    try:
+        cache.incr(_key(name), delta)
+    except ValueError:
+        _register(name)
+        cache.set(_key(name), delta, None)
+
+
+def gauge(name, value):
+    """Запоминает текущее значение показателя."""
+    _register(name)
+    cache.set(_key(name), value, None)
+
+
+def snapshot():
+    names = sorted(cache.get(NAMES_KEY, set()))
+    values = cache.get_many([_key(name) for name in names])
+    return {name: values.get(_key(name), 0) for name in names}
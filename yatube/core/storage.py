@@ -0,0 +1,70 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH = re.compile(r'[0-9a-f]{64}')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, где имя файла - хеш его содержимого.
+    Хеш считается, пока загрузка пишется во временный файл,
+    и одинаковые загрузки сохраняются на диск один раз.
+    Файлы раскладываются по подкаталогам из первых символов хеша
+    (posts/ab/cd/abcd....jpg), чтобы ни один каталог не разрастался.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Совпадение имён - это совпадение содержимого, а не конфликт.
+        return name
+
+    def hashed_name(self, directory, digest, extension):
+        return os.path.join(
+            directory, digest[:2], digest[2:4], digest + extension
+        )
+
+    def is_hashed(self, name):
+        """Лежит ли файл уже под своим хешем в нужном подкаталоге."""
+        directory, filename = os.path.split(name)
+        digest, extension = os.path.splitext(filename)
+        if not HASH.fullmatch(digest):
+            return False
+        upload_directory = os.path.dirname(os.path.dirname(directory))
+        return self.hashed_name(
+            upload_directory, digest, extension
+        ).replace('\\', '/') == name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+        digest = hashlib.sha256()
+        descriptor, temporary = tempfile.mkstemp(
+            dir=full_directory, suffix='.part'
+        )
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    file.write(chunk)
+            name = self.hashed_name(directory, digest.hexdigest(), extension)
+            path = self.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(temporary)
+                # Свежая дата защищает файл от сборщика мусора.
+                os.utime(path)
+            else:
+                if self.file_permissions_mode is not None:
+                    os.chmod(temporary, self.file_permissions_mode)
+                os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name.replace('\\', '/')
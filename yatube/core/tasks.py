@@ -0,0 +1,237 @@
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CLAIM_ATTEMPTS = 5
+
+
+def task(priority=0, max_attempts=3):
+    """Делает функцию задачей очереди: func.delay(*args, **kwargs)
+    ставит вызов в очередь. Аргументы должны сериализоваться в JSON.
+    """
+    def decorator(func):
+        func.task_name = f'{func.__module__}.{func.__name__}'
+        func.priority = priority
+        func.max_attempts = max_attempts
+        func.delay = lambda *args, **kwargs: enqueue(func, args, kwargs)
+        return func
+    return decorator
+
+
+def enqueue(func, args=(), kwargs=None, priority=None, delay=0, key=None):
+    """Ставит задачу в очередь в текущей транзакции: она появится
+    у обработчиков только вместе с данными, ради которых поставлена.
+    Задача с занятым ключом key не ставится, тогда возвращается None.
+    При TASKS_EAGER задача выполняется сразу.
+    """
+    from .models import Task
+    arguments = json.dumps({'args': list(args), 'kwargs': kwargs or {}})
+    if settings.TASKS_EAGER:
+        decoded = json.loads(arguments)
+        func(*decoded['args'], **decoded['kwargs'])
+        return None
+    try:
+        with transaction.atomic():
+            return Task.objects.create(
+                name=func.task_name,
+                arguments=arguments,
+                priority=func.priority if priority is None else priority,
+                max_attempts=func.max_attempts,
+                run_at=timezone.now() + timedelta(seconds=delay),
+                key=key,
+            )
+    except IntegrityError:
+        if key is None:
+            raise
+        return None
+
+
+def claim(worker):
+    """Забирает самую приоритетную из созданных задач.
+    Несколько обработчиков не получат одну задачу: забирает тот,
+    чей условный UPDATE изменил строку.
+    """
+    from .models import Task
+    for _ in range(CLAIM_ATTEMPTS):
+        now = timezone.now()
+        candidate = Task.objects.filter(
+            status=Task.QUEUED, run_at__lte=now
+        ).values_list('pk', flat=True).first()
+        if candidate is None:
+            return None
+        claimed = Task.objects.filter(
+            pk=candidate, status=Task.QUEUED
+        ).update(
+            status=Task.RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Task.objects.get(pk=candidate)
+    return None
+
+
+def backoff(attempts):
+    """Пауза перед повтором: растёт вдвое с каждой попыткой,
+    со случайным разбросом, чтобы повторы не шли пачкой.
+    """
+    delay = settings.TASK_RETRY_DELAY * 2 ** (attempts - 1)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def execute(task_):
+    """Выполняет взятую задачу. Успешная задача удаляется, а задача
+    с ключом остаётся выполненной, чтобы ключ оставался занят.
+    Упавшая возвращается в очередь с паузой или помечается ошибкой.
+    """
+    from .models import Task
+    try:
+        func = import_string(task_.name)
+        arguments = json.loads(task_.arguments)
+        func(*arguments['args'], **arguments['kwargs'])
+    except Exception:
+        logger.exception('Задача %s упала', task_)
+        error = traceback.format_exc()
+        if task_.attempts < task_.max_attempts:
+            Task.objects.filter(pk=task_.pk).update(
+                status=Task.QUEUED,
+                run_at=timezone.now() + timedelta(
+                    seconds=backoff(task_.attempts)
+                ),
+                locked_by='',
+                locked_at=None,
+                error=error,
+            )
+        else:
+            Task.objects.filter(pk=task_.pk).update(
+                status=Task.FAILED, error=error
+            )
+        return False
+    done = Task.objects.filter(pk=task_.pk)
+    if task_.key is None:
+        done.delete()
+    else:
+        done.update(status=Task.DONE, error='')
+    return True
+
+
+def run_next(worker):
+    """Выполняет одну задачу. Возвращает False, если очередь пуста."""
+    task_ = claim(worker)
+    if task_ is None:
+        return False
+    execute(task_)
+    return True
+
+
+def release_stale():
+    """Возвращает в очередь задачи упавших обработчиков:
+    занятые дольше TASK_TIMEOUT секунд.
+    """
+    from .models import Task
+    stale = Task.objects.filter(
+        status=Task.RUNNING,
+        locked_at__lt=timezone.now() - timedelta(
+            seconds=settings.TASK_TIMEOUT
+        )
+    )
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.FAILED, error='Обработчик не завершил задачу'
+    )
+    return stale.update(status=Task.QUEUED, locked_by='', locked_at=None)
+
+
+def purge_done():
+    """Удаляет выполненные задачи с ключом, интервал которых прошёл."""
+    from .models import Task
+    keep = max(settings.TASK_SCHEDULE.values(), default=0)
+    return Task.objects.filter(
+        status=Task.DONE,
+        run_at__lt=timezone.now() - timedelta(seconds=keep)
+    ).delete()[0]
+
+
+def schedule(now=None):
+    """Ставит периодические задачи из TASK_SCHEDULE.
+    Ключ задачи - номер интервала, поэтому несколько запущенных
+    планировщиков не поставят одну задачу дважды.
+    """
+    now = now or time.time()
+    scheduled = 0
+    for name, interval in settings.TASK_SCHEDULE.items():
+        slot = int(now // interval)
+        if enqueue(import_string(name), key=f'schedule:{name}:{slot}'):
+            scheduled += 1
+    return scheduled
+
+
+def work(stop, poll_interval, parent):
+    """Цикл процесса-обработчика: берёт задачи, пока не выставлен stop
+    и жив запустивший его процесс. Сигналы остановки получает родитель,
+    чтобы текущая задача не обрывалась на середине.
+    """
+    django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    while not stop.is_set() and os.getppid() == parent:
+        close_old_connections()
+        try:
+            busy = run_next(worker)
+        except Exception:
+            logger.exception('Обработчик %s не смог взять задачу', worker)
+            busy = False
+        if not busy:
+            stop.wait(poll_interval)
+
+
+def _interrupt(*args):
+    raise KeyboardInterrupt
+
+
+def run_workers(workers, poll_interval=1):
+    """Запускает процессы-обработчики, а сам планирует периодические
+    задачи и освобождает зависшие. Завершается по SIGINT или SIGTERM,
+    дав обработчикам закончить текущие задачи.
+    """
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    processes = [
+        context.Process(
+            target=work, args=(stop, poll_interval, os.getpid())
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # stop.set() нельзя звать из обработчика сигнала: основной поток
+    # в это время может держать тот же замок внутри stop.wait().
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            schedule()
+            release_stale()
+            purge_done()
+            stop.wait(poll_interval)
+    except KeyboardInterrupt:
+        stop.set()
+    for process in processes:
+        process.join()
@@ -0,0 +1,29 @@
+from django import template
+from django.conf import settings
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_window(page_obj, size=None):
+    """Номера страниц вокруг текущей, первая и последняя.
+    Пропуски между ними обозначаются None.
+    """
+    size = settings.PAGINATOR_WINDOW if size is None else size
+    paginator = page_obj.paginator
+    last = paginator.num_pages
+    numbers = set(range(
+        max(1, page_obj.number - size),
+        min(last, page_obj.number + size) + 1
+    ))
+    numbers.add(1)
+    if getattr(paginator, 'counted', True):
+        numbers.add(last)
+    window = []
+    previous = 0
+    for number in sorted(numbers):
+        if number - previous > 1:
+            window.append(None)
+        window.append(number)
+        previous = number
+    return window
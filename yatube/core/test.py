@@ -1,4 +1,38 @@
-from django.test import Client, TestCase
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.test import Client, TestCase, override_settings
+
+from . import metrics, tasks
+from .cache import CacheBroadcast, LRUStore, TwoTierCache
+from .models import Task
+from .templatetags.pagination import page_window
+
+
+calls = []
+
+
+@tasks.task()
+def remember(value):
+    calls.append(value)
+
+
+@tasks.task(priority=5)
+def urgent(value):
+    calls.append(value)
+
+
+@tasks.task()
+def tick():
+    calls.append('тик')
+
+
+@tasks.task(max_attempts=2)
+def broken():
+    raise ValueError('сломано')
 
 
 class CoreTests(TestCase):
@@ -9,3 +43,158 @@ class CoreTests(TestCase):
         """URL-адрес использует соответствующий шаблон."""
         response = self.guest_client.get('/non-page/')
         self.assertTemplateUsed(response, 'core/404.html')
+
+    def test_metrics_for_staff_only(self):
+        """Метрики отдаются только персоналу."""
+        cache.clear()
+        metrics.incr('test.hits')
+        metrics.incr('test.hits', 2)
+        metrics.gauge('test.size', 10)
+        response = self.guest_client.get('/metrics/')
+        self.assertEqual(response.status_code, 302)
+        staff = get_user_model().objects.create_user(
+            username='staff', is_staff=True
+        )
+        self.guest_client.force_login(staff)
+        response = self.guest_client.get('/metrics/')
+        self.assertEqual(
+            response.json(), {'test.hits': 3, 'test.size': 10}
+        )
+
+    def test_page_window(self):
+        """Пагинатор показывает окно вокруг текущей страницы,
+        первую и последнюю."""
+        paginator = Paginator(range(1000), 10)
+        cases = (
+            (1, [1, 2, 3, None, 100]),
+            (50, [1, None, 48, 49, 50, 51, 52, None, 100]),
+            (99, [1, None, 97, 98, 99, 100]),
+        )
+        for number, expected in cases:
+            with self.subTest(number=number):
+                self.assertEqual(
+                    page_window(paginator.page(number), 2), expected
+                )
+
+
+TEMP_CACHE_DIR = tempfile.mkdtemp()
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': f'{TEMP_CACHE_DIR}/cache.sqlite3',
+    },
+})
+class TwoTierCacheTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_CACHE_DIR, ignore_errors=True)
+
+    def worker(self):
+        """Кэш отдельного процесса: свой L1 над общим L2."""
+        worker = TwoTierCache('shared', {'OPTIONS': {
+            'POLL_INTERVAL': 0, 'SHARED_ONLY_PREFIXES': ('metrics:',)
+        }})
+        worker._l1 = LRUStore(1024, worker._l1.broadcast.__class__())
+        return worker
+
+    def test_invalidation_reaches_other_processes(self):
+        """Запись в одном процессе сбрасывает L1 в остальных."""
+        first, second = self.worker(), self.worker()
+        first.clear()
+        first.set('key', 'old')
+        self.assertEqual(second.get('key'), 'old')
+        first.set('key', 'new')
+        self.assertEqual(second.get('key'), 'new')
+        first.delete('key')
+        self.assertIsNone(second.get('key'))
+        first.set('hits', 1)
+        self.assertEqual(second.get('hits'), 1)
+        self.assertEqual(first.incr('hits'), 2)
+        self.assertEqual(second.get_many(['hits']), {'hits': 2})
+
+    def test_shared_only_keys_skip_broadcast(self):
+        """Счётчики метрик пишутся только в L2 и не засоряют журнал."""
+        first, second = self.worker(), self.worker()
+        first.clear()
+        seq = first.shared.get(CacheBroadcast.seq_key)
+        first.set('metrics:hits', 1)
+        self.assertEqual(second.get('metrics:hits'), 1)
+        for _ in range(3):
+            first.incr('metrics:hits')
+        self.assertEqual(
+            second.get_many(['metrics:hits']), {'metrics:hits': 4}
+        )
+        self.assertEqual(first.shared.get(CacheBroadcast.seq_key), seq)
+
+    def test_failed_write_leaves_no_transaction(self):
+        """Несериализуемое значение не оставляет соединение
+        посреди транзакции."""
+        shared = self.worker().shared
+        with self.assertRaises(Exception):
+            shared.set_many({'good': 1, 'bad': lambda: None})
+        with self.assertRaises(Exception):
+            shared.add('bad', lambda: None)
+        shared.set_many({'good': 2})
+        self.assertTrue(shared.add('other', 3))
+        self.assertEqual(
+            shared.get_many(['good', 'other']), {'good': 2, 'other': 3}
+        )
+
+    def test_l1_bounded_by_bytes(self):
+        """L1 вытесняет давно не читанные значения по размеру."""
+        store = LRUStore(100, None)
+        store.set('a', b'x' * 40, float('inf'))
+        store.set('b', b'x' * 40, float('inf'))
+        store.get('a')
+        store.set('c', b'x' * 40, float('inf'))
+        self.assertIsNone(store.get('b'))
+        self.assertIsNotNone(store.get('a'))
+        self.assertLessEqual(store.size, 100)
+
+
+@override_settings(TASKS_EAGER=False, TASK_RETRY_DELAY=60)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_priority_order(self):
+        """Приоритетные задачи выполняются раньше, успешные удаляются."""
+        remember.delay('обычная')
+        urgent.delay('срочная')
+        while tasks.run_next('test'):
+            pass
+        self.assertEqual(calls, ['срочная', 'обычная'])
+        self.assertFalse(Task.objects.exists())
+
+    def test_retry_with_backoff(self):
+        """Упавшая задача откладывается, а после всех попыток
+        остаётся с ошибкой."""
+        task = broken.delay()
+        self.assertTrue(tasks.run_next('test'))
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.QUEUED)
+        self.assertGreater(task.run_at, task.created)
+        self.assertIn('сломано', task.error)
+        self.assertFalse(tasks.run_next('test'))
+        Task.objects.update(run_at=task.created)
+        self.assertTrue(tasks.run_next('test'))
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.FAILED)
+        self.assertEqual(task.attempts, 2)
+
+    @override_settings(TASK_SCHEDULE={'core.test.tick': 60})
+    def test_schedule_once_per_interval(self):
+        """Планировщик ставит задачу один раз за интервал."""
+        self.assertEqual(tasks.schedule(now=120), 1)
+        self.assertEqual(tasks.schedule(now=179), 0)
+        self.assertEqual(tasks.schedule(now=180), 1)
+        while tasks.run_next('test'):
+            pass
+        self.assertEqual(calls, ['тик', 'тик'])
+        self.assertEqual(tasks.schedule(now=180), 0)
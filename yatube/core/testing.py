@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+
+class QueryBudgetMixin:
+    """Проверка бюджета запросов, объявленного через @query_budget."""
+
+    def assertWithinQueryBudget(self, client, url):
+        budget = getattr(resolve(url).func, 'query_budget', None)
+        self.assertIsNotNone(budget, f'Для {url} не объявлен бюджет')
+        with CaptureQueriesContext(connection) as context:
+            client.get(url)
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertLessEqual(
+            len(context), budget,
+            f'{url} сделал {len(context)} запросов при бюджете {budget}:\n'
+            f'{queries}'
+        )
+
+
+def isolated_caches(directory):
+    """settings.CACHES, в котором файловые кэши лежат в directory,
+    а не в общем файле разработчика или сервера.
+    """
+    isolated = {}
+    for alias, config in settings.CACHES.items():
+        if config['BACKEND'] == 'core.cache.SQLiteCache':
+            config = {
+                **config,
+                'LOCATION': os.path.join(directory, f'{alias}.sqlite3'),
+            }
+        isolated[alias] = config
+    return isolated
+
+
+def prepare_test_environment():
+    """Тесты получают свой пустой общий кэш во временном каталоге.
+    Фоновые процессы не видят тестовую базу и временные MEDIA_ROOT,
+    поэтому миниатюры создаются, а задачи очереди выполняются сразу.
+    Возвращает функцию, которая восстанавливает настройки.
+    """
+    directory = tempfile.mkdtemp()
+    override = override_settings(
+        CACHES=isolated_caches(directory),
+        THUMBNAIL_WORKERS=0,
+        TASKS_EAGER=True,
+    )
+    override.enable()
+
+    def restore():
+        override.disable()
+        shutil.rmtree(directory, ignore_errors=True)
+    return restore
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.restore_environment = prepare_test_environment()
+
+    def teardown_test_environment(self, **kwargs):
+        self.restore_environment()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """Передаёт следующим обработчикам не больше UPLOAD_MAX_SIZE + 1 байт
+    каждого файла. Остаток слишком большой загрузки не пишется ни в память,
+    ни на диск, а форма видит размер больше лимита и отклоняет файл.
+    """
+
+    def receive_data_chunk(self, raw_data, start):
+        limit = settings.UPLOAD_MAX_SIZE + 1
+        if start >= limit:
+            return None
+        return raw_data[:limit - start]
+
+    def file_complete(self, file_size):
+        return None
+
+
+def too_large(file):
+    return file.size > settings.UPLOAD_MAX_SIZE
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Comment, Follow, Group, Post
+from . import search
+from .models import Comment, Counter, Follow, Group, Post
 
 
 @admin.register(Post)
@@ -17,6 +18,13 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            pk__in=search.matching_posts(search_term)
+        ), False
+
 
 @admin.register(Group)
 class GroupAdmin(admin.ModelAdmin):
@@ -41,6 +49,13 @@ class CommentAdmin(admin.ModelAdmin):
     list_filter = ('created',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            pk__in=search.matching_comments(search_term)
+        ), False
+
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
@@ -53,3 +68,12 @@ class FollowAdmin(admin.ModelAdmin):
     search_fields = ('user',)
     list_filter = ('author',)
     empty_value_display = '-пусто-'
+
+
+@admin.register(Counter)
+class CounterAdmin(admin.ModelAdmin):
+    list_display = (
+        'scope',
+        'value',
+    )
+    search_fields = ('scope',)
@@ -0,0 +1,107 @@
+import logging
+import threading
+import zipfile
+
+from django.conf import settings
+
+from .media import image_storage
+from .models import Post
+from .transfer import export_chunks
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+_slots = None
+_slots_lock = threading.Lock()
+
+
+def slots():
+    global _slots
+    with _slots_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(settings.ARCHIVE_MAX_JOBS)
+    return _slots
+
+
+class _Buffer:
+    """Приёмник для ZipFile, из которого записанное забирается
+    кусками. Позиции нет, поэтому zipfile пишет размеры после данных.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+
+class Archive:
+    """ZIP с постами и комментариями пользователя в NDJSON
+    и исходными картинками его постов. Собирается по ходу отдачи:
+    в памяти держится одна пачка записей или кусок файла.
+    Занимает слот из ARCHIVE_MAX_JOBS до закрытия ответа.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.released = False
+
+    @classmethod
+    def start(cls, user):
+        """Архив или None, если все слоты процесса заняты."""
+        if not slots().acquire(blocking=False):
+            return None
+        return cls(user)
+
+    def close(self):
+        if not self.released:
+            self.released = True
+            slots().release()
+
+    def __iter__(self):
+        return filter(None, self.build())
+
+    def build(self):
+        buffer = _Buffer()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for kind, filters in (
+                ('posts', {'author_id': self.user.pk}),
+                ('comments', {'author_id': self.user.pk}),
+            ):
+                with archive.open(f'{kind}.ndjson', 'w') as entry:
+                    for chunk, _ in export_chunks(kind, **filters):
+                        entry.write(chunk)
+                        yield buffer.drain()
+            yield from self.images(archive, buffer)
+        yield buffer.drain()
+
+    def images(self, archive, buffer):
+        storage = image_storage()
+        names = Post.objects.filter(author_id=self.user.pk).exclude(
+            image=''
+        ).order_by('image').values_list('image', flat=True).distinct()
+        for name in names.iterator():
+            try:
+                source = storage.open(name)
+            except OSError:
+                logger.warning('Картинка %s не найдена', name)
+                continue
+            info = zipfile.ZipInfo(f'images/{name}')
+            # Картинки уже сжаты, второй раз их не жмём.
+            info.compress_type = zipfile.ZIP_STORED
+            with source, archive.open(
+                info, 'w', force_zip64=source.size > zipfile.ZIP64_LIMIT
+            ) as entry:
+                for chunk in source.chunks(COPY_CHUNK_SIZE):
+                    entry.write(chunk)
+                    yield buffer.drain()
@@ -0,0 +1,87 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from core import metrics
+
+from . import thumbnails
+
+CARD_TEMPLATE = 'includes/past_article.html'
+
+
+def version_key(kind, pk):
+    return f'card:version:{kind}:{pk}'
+
+
+def bump(kind, pk):
+    """Устаревают все карточки, в которых участвует объект."""
+    try:
+        cache.incr(version_key(kind, pk))
+    except ValueError:
+        cache.set(version_key(kind, pk), _new_version(), None)
+
+
+def _new_version():
+    # Версия после вытеснения из кэша не должна совпасть с прежней.
+    return int(time.time() * 1000)
+
+
+def _versions(posts):
+    keys = set()
+    for post in posts:
+        keys.add(version_key('post', post.pk))
+        keys.add(version_key('user', post.author_id))
+        if post.group_id:
+            keys.add(version_key('group', post.group_id))
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys - versions.keys()}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def card_key(post, versions, flags):
+    return 'card:{}:{}:{}:{}:{}:{}'.format(
+        post.pk,
+        post.pub_date.timestamp(),
+        ''.join('1' if flag else '0' for flag in flags),
+        versions[version_key('post', post.pk)],
+        versions[version_key('user', post.author_id)],
+        versions.get(version_key('group', post.group_id), 0),
+    )
+
+
+def render_cards(posts, author_link=False, groups_posts_link=False):
+    """HTML карточек постов страницы.
+    Готовые карточки берутся из кэша одним get_many,
+    недостающие рендерятся и кладутся обратно.
+    """
+    posts = list(posts)
+    if not posts:
+        return []
+    versions = _versions(posts)
+    keys = [
+        card_key(post, versions, (author_link, groups_posts_link))
+        for post in posts
+    ]
+    cards = cache.get_many(keys)
+    stale = [post for post, key in zip(posts, keys) if key not in cards]
+    pictures = thumbnails.resolve(post.image for post in stale)
+    missing = {}
+    for post, key in zip(posts, keys):
+        if key not in cards:
+            missing[key] = render_to_string(CARD_TEMPLATE, {
+                'post': post,
+                'picture': pictures.get(post.image.name),
+                'author_link': author_link,
+                'groups_posts_link': groups_posts_link,
+            })
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_TIMEOUT)
+        cards.update(missing)
+    metrics.incr('cards.hits', len(posts) - len(missing))
+    metrics.incr('cards.misses', len(missing))
+    return [cards[key] for key in keys]
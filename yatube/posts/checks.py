@@ -0,0 +1,17 @@
+from django.core.checks import Warning, register
+from PIL import features
+
+
+@register()
+def webp_support(app_configs, **kwargs):
+    """Без WebP в Pillow варианты картинок создаются только в JPEG."""
+    if features.check('webp'):
+        return []
+    return [Warning(
+        'Pillow собран без поддержки WebP, миниатюры будут только в JPEG.',
+        hint=(
+            'Установите Pillow из wheel с PyPI, в нём есть libwebp, '
+            'или соберите его с установленным libwebp-dev.'
+        ),
+        id='posts.W001',
+    )]
@@ -0,0 +1,115 @@
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Counter, Follow, Post
+
+
+def scope(kind, pk=None):
+    return kind if pk is None else f'{kind}:{pk}'
+
+
+def get_counts(querysets):
+    """Значения нескольких счётчиков одним запросом.
+    Отсутствующий счётчик один раз считается точно по своему queryset.
+    """
+    values = dict(
+        Counter.objects.filter(scope__in=querysets).values_list(
+            'scope', 'value'
+        )
+    )
+    for name, queryset in querysets.items():
+        if name not in values:
+            values[name] = queryset.count()
+            Counter.objects.get_or_create(
+                scope=name, defaults={'value': values[name]}
+            )
+    return {name: max(value, 0) for name, value in values.items()}
+
+
+def get_count(name, queryset):
+    return get_counts({name: queryset})[name]
+
+
+def user_counts(user_id):
+    """Число постов, подписчиков и подписок пользователя."""
+    values = get_counts({
+        scope('author', user_id): Post.objects.filter(author_id=user_id),
+        scope('followers', user_id): Follow.objects.filter(
+            author_id=user_id
+        ),
+        scope('following', user_id): Follow.objects.filter(user_id=user_id),
+    })
+    return {
+        'posts': values[scope('author', user_id)],
+        'followers': values[scope('followers', user_id)],
+        'following': values[scope('following', user_id)],
+    }
+
+
+def change(scopes, delta):
+    """Атомарно сдвигает счётчики на delta.
+    Ещё не созданные счётчики пропускаются:
+    их посчитает get_count при первом чтении.
+    """
+    if scopes and delta:
+        Counter.objects.filter(scope__in=scopes).update(
+            value=F('value') + delta
+        )
+
+
+def post_scopes(post, group_id=None):
+    """Счётчики, которые пост сдвигает сразу.
+    Счётчики лент подписчиков сдвигает задача раскладки.
+    """
+    scopes = [scope('posts'), scope('author', post.author_id)]
+    if group_id:
+        scopes.append(scope('group', group_id))
+    return scopes
+
+
+def recount():
+    """Точно пересчитывает счётчики и число комментариев постов,
+    исправляя накопленный дрейф.
+    Возвращает число обновлённых счётчиков.
+    """
+    values = {scope('posts'): Post.objects.count()}
+    for kind, field in (('group', 'group'), ('author', 'author')):
+        rows = Post.objects.filter(**{f'{field}__isnull': False}).values(
+            field
+        ).annotate(total=Count('id')).order_by()
+        values.update(
+            (scope(kind, row[field]), row['total']) for row in rows
+        )
+    rows = Follow.objects.values('user').annotate(
+        total=Count('author__posts')
+    ).order_by()
+    values.update((scope('feed', row['user']), row['total']) for row in rows)
+    for kind, field in (('followers', 'author'), ('following', 'user')):
+        rows = Follow.objects.values(field).annotate(
+            total=Count('id')
+        ).order_by()
+        values.update(
+            (scope(kind, row[field]), row['total']) for row in rows
+        )
+    rows = Post.objects.exclude(image='').values('image').annotate(
+        total=Count('id')
+    ).order_by()
+    values.update((scope('image', row['image']), row['total']) for row in rows)
+    updated = 0
+    for counter in Counter.objects.all().iterator():
+        value = values.pop(counter.scope, 0)
+        if counter.value != value:
+            Counter.objects.filter(pk=counter.pk).update(value=value)
+            updated += 1
+    Counter.objects.bulk_create(
+        Counter(scope=name, value=value) for name, value in values.items()
+    )
+    posts = Post.objects.annotate(total=Count('comments')).exclude(
+        comments_count=F('total')
+    ).order_by().values_list('id', 'total')
+    for pk, total in posts.iterator():
+        Post.objects.filter(pk=pk).update(
+            comments_count=total, updated_at=timezone.now()
+        )
+        updated += 1
+    return updated + len(values)
@@ -1,5 +1,10 @@
 from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
 
+from core.uploads import too_large
+
+from . import images
 from .models import Comment, Post
 
 
@@ -12,6 +17,14 @@ class PostForm(forms.ModelForm):
         self.fields['group'].empty_label = (
             'Выберите группу'
         )
+        image = self.files.get('image')
+        self.image_too_large = image is not None and too_large(image)
+        if self.image_too_large:
+            # Файл обрезан обработчиком загрузки, открывать его незачем.
+            self.files = {
+                name: file for name, file in self.files.items()
+                if name != 'image'
+            }
 
     def clean_text(self):
         text = self.cleaned_data['text']
@@ -19,6 +32,18 @@ class PostForm(forms.ModelForm):
             raise forms.ValidationError('Нельзя применять слово "блин"')
         return text
 
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        if self.image_too_large:
+            raise forms.ValidationError(
+                'Файл больше %(size)d МБ',
+                code='file_too_large',
+                params={'size': settings.UPLOAD_MAX_SIZE // 1024 // 1024},
+            )
+        if isinstance(image, UploadedFile):
+            return images.prepare(image)
+        return image
+
     class Meta:
         model = Post
         fields = ('group', 'text', 'image')
@@ -0,0 +1,133 @@
+import os
+import tempfile
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.forms import ValidationError
+from PIL import Image, ImageOps
+
+from . import thumbnails
+
+METADATA = ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment')
+QUALITY_FORMATS = ('JPEG', 'WEBP')
+# Многокадровые форматы, кадры которых - анимация. У MPO с камер
+# телефонов второй кадр - превью или стереопара, фото в первом.
+ANIMATED_FORMATS = ('GIF', 'PNG', 'WEBP')
+# Форматы, которые Pillow читает, но не пишет.
+SAVE_FORMATS = {'MPO': 'JPEG'}
+# Остальные такие форматы (XPM, PSD) пересохраняются в PNG
+# или, без прозрачности, в JPEG.
+FALLBACK_EXTENSIONS = {'PNG': '.png', 'JPEG': '.jpg'}
+
+
+def save_format(image):
+    format_ = SAVE_FORMATS.get(image.format, image.format)
+    Image.init()
+    if format_ in Image.SAVE:
+        return format_
+    if 'A' in image.mode or 'transparency' in image.info:
+        return 'PNG'
+    return 'JPEG'
+
+
+def process(source, output, max_side, quality):
+    """Уменьшает изображение из файла source до max_side по большей
+    стороне, поворачивает по EXIF и пишет в файл output без метаданных
+    (цветовой профиль остаётся). Выполняется в процессе пула.
+    Возвращает формат записанного файла или None, если изображение
+    и так подходит: лишнее пересжатие только портит качество.
+    Анимации не уменьшаются, только очищаются от метаданных.
+    """
+    with Image.open(source) as image:
+        animated = (
+            image.format in ANIMATED_FORMATS
+            and getattr(image, 'is_animated', False)
+        )
+        has_metadata = any(key in image.info for key in METADATA)
+        if not has_metadata and (animated or max(image.size) <= max_side):
+            return None
+        format_ = save_format(image)
+        options = {'optimize': True, 'exif': b''}
+        if image.info.get('icc_profile'):
+            options['icc_profile'] = image.info['icc_profile']
+        if animated:
+            image.save(output, format_, save_all=True, **options)
+            return format_
+        if format_ in QUALITY_FORMATS:
+            options['quality'] = quality
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if format_ == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+            image = image.convert('RGB')
+        image.save(output, format_, **options)
+    return format_
+
+
+@contextmanager
+def source_path(upload):
+    """Путь к загрузке на диске. Большие загрузки Django уже пишет
+    во временный файл, маленькие из памяти сбрасываются в свой.
+    """
+    if hasattr(upload, 'temporary_file_path'):
+        yield upload.temporary_file_path()
+        return
+    with tempfile.NamedTemporaryFile(
+        suffix='.upload', dir=settings.FILE_UPLOAD_TEMP_DIR
+    ) as file:
+        for chunk in upload.chunks():
+            file.write(chunk)
+        file.flush()
+        yield file.name
+
+
+def prepare(upload):
+    """Проверяет загруженное изображение и готовит его к сохранению.
+    Декодирование и сжатие идут в пуле миниатюр, а не в потоке запроса.
+    Процессу пула передаются пути к файлам, а не содержимое.
+    """
+    # Размеры берутся из заголовка, который уже прочитал ImageField.
+    width, height = upload.image.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Изображение больше %(pixels)d мегапикселей',
+            code='image_too_large',
+            params={'pixels': settings.IMAGE_MAX_PIXELS // 1000 // 1000},
+        )
+    output = TemporaryUploadedFile(
+        upload.name, upload.content_type, 0, None
+    )
+    with source_path(upload) as source:
+        arguments = (
+            source, output.temporary_file_path(),
+            settings.IMAGE_MAX_SIDE, settings.IMAGE_QUALITY
+        )
+        if settings.THUMBNAIL_WORKERS:
+            future = thumbnails.get_pool().submit(process, *arguments)
+        else:
+            future = Future()
+            try:
+                future.set_result(process(*arguments))
+            except Exception as error:
+                future.set_exception(error)
+        try:
+            format_ = future.result()
+        except (OSError, SyntaxError, ValueError):
+            output.close()
+            raise ValidationError(
+                'Не удалось обработать изображение', code='invalid_image'
+            )
+    if format_ is None:
+        output.close()
+        upload.seek(0)
+        return upload
+    root, extension = os.path.splitext(upload.name)
+    if (
+        format_ in FALLBACK_EXTENSIONS
+        and Image.registered_extensions().get(extension.lower()) != format_
+    ):
+        output.name = root + FALLBACK_EXTENSIONS[format_]
+    output.size = os.path.getsize(output.temporary_file_path())
+    output.seek(0)
+    return output
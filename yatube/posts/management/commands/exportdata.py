@@ -0,0 +1,74 @@
+import gzip
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+from posts.transfer import EXPORT_CHUNK_SIZE, KINDS, export_chunks
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоково выгружает посты, комментарии или подписки в NDJSON '
+        'в формате importdata.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('path', help='Файл для выгрузки.')
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Сжимать выгрузку в gzip.'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help='Сколько строк выбирать одним запросом.'
+        )
+        parser.add_argument(
+            '--after',
+            type=int,
+            default=0,
+            help='Выгружать записи с id больше этого.'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Продолжить прерванную выгрузку в тот же файл '
+                 'по <path>.resume.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        token = f'{path}.resume'
+        after, mode = options['after'], 'wb'
+        if options['resume'] and os.path.exists(token):
+            with open(token) as file:
+                state = json.load(file)
+            after, mode = state['after'], 'r+b'
+        exported = 0
+        with open(path, mode) as output:
+            if mode == 'r+b':
+                # Хвост после последней сохранённой пачки отбрасывается.
+                output.truncate(state['size'])
+                output.seek(state['size'])
+            for chunk, after in export_chunks(
+                options['kind'], after, options['chunk_size']
+            ):
+                lines = chunk.count(b'\n')
+                # Каждая пачка - отдельный член gzip: файл можно обрезать
+                # по границе пачки и дописать.
+                if options['gzip']:
+                    chunk = gzip.compress(chunk)
+                output.write(chunk)
+                output.flush()
+                exported += lines
+                with open(token, 'w') as file:
+                    json.dump({'after': after, 'size': output.tell()}, file)
+        if os.path.exists(token):
+            os.remove(token)
+        self.stdout.write(
+            f'Выгружено строк: {exported}, последний id: {after}'
+        )
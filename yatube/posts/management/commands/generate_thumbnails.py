@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import backfill
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие миниатюры для уже загруженных изображений.'
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').only('image')
+        created, failed = backfill(post.image for post in posts.iterator())
+        self.stdout.write(
+            f'Создано миниатюр: {created}, с ошибками: {failed}'
+        )
@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.transfer import FORMATS, KINDS, Importer, rebuild_derived
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоково загружает посты, комментарии или подписки '
+        'из NDJSON или CSV.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('path', help='Файл с данными.')
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Формат файла, по умолчанию по расширению.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Сколько строк вставлять в одной транзакции.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл с позицией для продолжения, по умолчанию '
+                 '<path>.checkpoint.'
+        )
+        parser.add_argument(
+            '--no-rebuild',
+            action='store_true',
+            help='Не пересчитывать счётчики '
+                 '(если следом грузится ещё один файл).'
+        )
+
+    def handle(self, *args, **options):
+        reported = 0
+
+        def progress(importer, rate):
+            nonlocal reported
+            if time.monotonic() - reported >= 5:
+                reported = time.monotonic()
+                self.stdout.write(
+                    f'Загружено: {importer.imported}, '
+                    f'пропущено: {importer.skipped}, '
+                    f'{rate:.0f} строк/с'
+                )
+
+        importer = Importer(
+            options['kind'],
+            options['path'],
+            format_=options['format'],
+            batch_size=options['batch_size'],
+            checkpoint=(
+                options['checkpoint'] or f'{options["path"]}.checkpoint'
+            ),
+            progress=progress,
+        )
+        started = time.monotonic()
+        imported, skipped = importer.run()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Загружено строк: {imported}, пропущено: {skipped}, '
+            f'{(imported + skipped) / elapsed if elapsed else 0:.0f} строк/с'
+        )
+        if not options['no_rebuild']:
+            rebuild_derived()
+            self.stdout.write('Счётчики пересчитаны')
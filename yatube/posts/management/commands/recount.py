@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import recount
+
+
+class Command(BaseCommand):
+    help = (
+        'Точно пересчитывает счётчики постов в лентах. '
+        'Запускайте периодически, например раз в сутки из cron.'
+    )
+
+    def handle(self, *args, **options):
+        updated = recount()
+        self.stdout.write(f'Исправлено счётчиков: {updated}')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from posts.media import shard
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов в подкаталоги по хешу содержимого '
+        'и переписывает пути в базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько имён файлов обрабатывать за одну пачку.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать файлы, которые нужно перенести.'
+        )
+
+    def handle(self, *args, **options):
+        moved = shard(options['batch_size'], options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f'Нужно перенести файлов: {moved}')
+        else:
+            self.stdout.write(f'Перенесено файлов: {moved}')
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from posts.sweeper import Sweeper
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки и миниатюры, на которые не ссылается ни один пост.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено.'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=50,
+            help='Сколько файлов удалять в секунду, 0 - без ограничения.'
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60,
+            help='Файлы моложе стольких минут не удаляются.'
+        )
+
+    def handle(self, *args, **options):
+        report = None
+        if options['dry_run'] or options['verbosity'] > 1:
+            report = self.stdout.write
+        files, size = Sweeper(
+            min_age=timedelta(minutes=options['min_age']),
+            rate=options['rate'],
+            dry_run=options['dry_run'],
+            report=report,
+        ).sweep()
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(
+            f'{verb} файлов: {files}, {size / 1024 / 1024:.1f} МБ'
+        )
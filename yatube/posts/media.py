@@ -0,0 +1,131 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.utils import timezone
+from sorl.thumbnail.images import ImageFile
+
+from core.generations import bump_generation
+
+from . import cards, counters, thumbnails
+from .models import Counter, Post
+
+logger = logging.getLogger(__name__)
+
+
+def image_scope(name):
+    return counters.scope('image', name)
+
+
+def references(name):
+    """Сколько постов ссылаются на файл."""
+    return counters.get_count(
+        image_scope(name), Post.objects.filter(image=name)
+    )
+
+
+def retain(name):
+    counters.change([image_scope(name)], 1)
+
+
+def release(name):
+    """Снимает ссылку поста на файл.
+    Файл без ссылок удаляется вместе с вариантами после коммита.
+    """
+    counters.change([image_scope(name)], -1)
+    if references(name) <= 0:
+        transaction.on_commit(lambda: delete_unused(name))
+
+
+def recently_touched(storage, name):
+    """Тронут ли файл за последние MEDIA_DELETE_GRACE секунд.
+    Хранилище обновляет дату файла при повторной загрузке,
+    а пост с ней может быть ещё не сохранён.
+    """
+    try:
+        modified = storage.get_modified_time(name)
+    except (OSError, SuspiciousFileOperation):
+        return False
+    return timezone.now() - modified < timedelta(
+        seconds=settings.MEDIA_DELETE_GRACE
+    )
+
+
+def delete_unused(name):
+    """Удаляет файл без ссылок вместе с вариантами.
+    Свежий файл остаётся, его уберёт sweep_media.
+    """
+    # Пока шла транзакция, тот же файл мог загрузить кто-то ещё.
+    if Post.objects.filter(image=name).exists():
+        return
+    storage = Post._meta.get_field('image').storage
+    if recently_touched(storage, name):
+        return
+    try:
+        thumbnails.delete(ImageFile(name, storage))
+    except Exception:
+        logger.exception('Не удалось удалить файл %s', name)
+
+
+def image_storage():
+    return Post._meta.get_field('image').storage
+
+
+def image_names(batch_size):
+    """Имена картинок постов пачками, по возрастанию, без OFFSET."""
+    last = ''
+    while True:
+        names = list(
+            Post.objects.filter(image__gt=last).order_by('image').values_list(
+                'image', flat=True
+            ).distinct()[:batch_size]
+        )
+        if not names:
+            return
+        yield names
+        last = names[-1]
+
+
+def move(name):
+    """Переносит файл под его хеш и переписывает ссылки постов.
+    После коммита старый файл удаляется, а для нового ставятся
+    в очередь варианты. Возвращает новое имя или None.
+    """
+    storage = image_storage()
+    try:
+        with storage.open(name) as file:
+            new_name = storage.save(name, file)
+    except (OSError, SuspiciousFileOperation):
+        logger.warning('Не удалось перенести файл %s', name)
+        return None
+    with transaction.atomic():
+        posts = Post.objects.filter(image=name)
+        post_ids = list(posts.values_list('id', flat=True))
+        posts.update(image=new_name)
+        Counter.objects.filter(scope=image_scope(name)).delete()
+        counters.change([image_scope(new_name)], len(post_ids))
+        transaction.on_commit(lambda: delete_unused(name))
+        thumbnails.queue(ImageFile(new_name, storage))
+    for pk in post_ids:
+        cards.bump('post', pk)
+    return new_name
+
+
+def shard(batch_size=500, dry_run=False):
+    """Раскладывает картинки постов по подкаталогам хеша.
+    Работает пачками, сайт при этом продолжает отдавать старые файлы.
+    Возвращает число файлов, которые нужно было перенести.
+    """
+    storage = image_storage()
+    moved = 0
+    for names in image_names(batch_size):
+        for name in names:
+            if storage.is_hashed(name):
+                continue
+            if dry_run or move(name):
+                moved += 1
+        if moved and not dry_run:
+            bump_generation('index_page')
+    return moved
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+from posts.stemmer import stem_text
+
+
+def fill_search_index(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO posts_post_search (rowid, text) VALUES (%s, %s)',
+            [
+                (pk, stem_text(text))
+                for pk, text in Post.objects.values_list('id', 'text')
+            ]
+        )
+        cursor.executemany(
+            'INSERT INTO posts_comment_search (rowid, text, post_id) '
+            'VALUES (%s, %s, %s)',
+            [
+                (pk, stem_text(text), post_id)
+                for pk, text, post_id in Comment.objects.values_list(
+                    'id', 'text', 'post_id'
+                )
+            ]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_post_comments_count'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE VIRTUAL TABLE posts_post_search USING fts5(text)',
+            'DROP TABLE posts_post_search',
+        ),
+        migrations.RunSQL(
+            'CREATE VIRTUAL TABLE posts_comment_search '
+            'USING fts5(text, post_id UNINDEXED)',
+            'DROP TABLE posts_comment_search',
+        ),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:09
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='counter',
+            name='scope',
+            field=models.CharField(max_length=128, unique=True, verbose_name='Область'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, storage=core.storage.ContentAddressedStorage(), upload_to='posts/', verbose_name='Картинка'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from core.models import CreatedModel
+from core.storage import ContentAddressedStorage
 from django.contrib.auth import get_user_model
 from django.db import models
 
@@ -53,13 +54,30 @@ class Post(CreatedModel):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+        editable=False
+    )
+    updated_at = models.DateTimeField(
+        'Изменён',
+        auto_now=True,
+        help_text='Меняется при правке поста и при каждом комментарии'
+    )
 
     class Meta:
         verbose_name = "Посты"
         verbose_name_plural = "Посты"
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(
+                fields=('pub_date', 'id'),
+                name='posts_post_pub_date_id_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -81,6 +99,15 @@ class Comment(models.Model):
         auto_now_add=True
     )
 
+    class Meta:
+        ordering = ('created', 'id')
+        indexes = [
+            models.Index(
+                fields=('post', 'created', 'id'),
+                name='posts_comment_thread_idx'
+            ),
+        ]
+
     def __str__(self):
         return self.text
 
@@ -108,3 +135,57 @@ class Follow(models.Model):
                 name="unique_pair"
             ),
         ]
+
+
+class Timeline(models.Model):
+    """Лента подписок, собранная заранее.
+    Пост попадает сюда при публикации
+    и при подписке на его автора.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пост'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = "Ленты подписок"
+        verbose_name_plural = "Ленты подписок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=("user", "post"),
+                name="unique_timeline_post"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', 'pub_date', 'post'),
+                name='posts_timeline_feed_idx'
+            ),
+        ]
+
+
+class Counter(models.Model):
+    """Счётчик постов в ленте.
+    Область задаётся строкой: posts, group:<id>,
+    author:<id>, feed:<id подписчика>, followers:<id автора>,
+    following:<id подписчика>, image:<файл> - число постов с картинкой,
+    pushing:<id автора> - посты автора ещё раскладываются по лентам.
+    """
+    scope = models.CharField('Область', max_length=128, unique=True)
+    value = models.IntegerField('Значение', default=0)
+
+    class Meta:
+        verbose_name = "Счётчики"
+        verbose_name_plural = "Счётчики"
+
+    def __str__(self):
+        return f'{self.scope}={self.value}'
@@ -0,0 +1,188 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Comment, Post
+from .stemmer import stem_text
+from .utils import CursorPage
+
+POST_TABLE = 'posts_post_search'
+COMMENT_TABLE = 'posts_comment_search'
+COMMENT_WEIGHT = 0.5
+INDEX_BATCH_SIZE = 500
+
+
+def match_query(query):
+    """Запрос FTS5 из основ слов: все слова обязательны.
+    Для запроса без слов возвращает None.
+    """
+    terms = stem_text(query).split()
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def index_post(post_id, text):
+    _index(POST_TABLE, post_id, {'text': stem_text(text)})
+
+
+def index_comment(comment_id, post_id, text):
+    _index(
+        COMMENT_TABLE, comment_id,
+        {'text': stem_text(text), 'post_id': post_id}
+    )
+
+
+def index_posts(posts):
+    """Индексирует пачку постов, заданных парами (id, текст)."""
+    _index_many(
+        POST_TABLE, ('text',),
+        [(pk, stem_text(text)) for pk, text in posts]
+    )
+
+
+def index_comments(comments):
+    """Индексирует пачку комментариев: (id, id поста, текст)."""
+    _index_many(
+        COMMENT_TABLE, ('text', 'post_id'),
+        [(pk, stem_text(text), post_id) for pk, post_id, text in comments]
+    )
+
+
+def unindex_post(post_id):
+    _unindex(POST_TABLE, post_id)
+
+
+def unindex_comment(comment_id):
+    _unindex(COMMENT_TABLE, comment_id)
+
+
+def _index(table, pk, columns):
+    _unindex(table, pk)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {} (rowid, {}) VALUES (%s, {})'.format(
+                table, ', '.join(columns), ', '.join(['%s'] * len(columns))
+            ),
+            [pk, *columns.values()]
+        )
+
+
+def _index_many(table, columns, rows):
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), INDEX_BATCH_SIZE):
+            pks = [row[0] for row in rows[start:start + INDEX_BATCH_SIZE]]
+            cursor.execute(
+                'DELETE FROM {} WHERE rowid IN ({})'.format(
+                    table, ', '.join(['%s'] * len(pks))
+                ),
+                pks
+            )
+        cursor.executemany(
+            'INSERT INTO {} (rowid, {}) VALUES (%s, {})'.format(
+                table, ', '.join(columns), ', '.join(['%s'] * len(columns))
+            ),
+            rows
+        )
+
+
+def _unindex(table, pk):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [pk])
+
+
+def rebuild():
+    """Заново индексирует все посты и комментарии.
+    Возвращает число проиндексированных записей.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {POST_TABLE}')
+        cursor.execute(f'DELETE FROM {COMMENT_TABLE}')
+    indexed = 0
+    for pk, text in Post.objects.values_list('id', 'text').iterator():
+        index_post(pk, text)
+        indexed += 1
+    comments = Comment.objects.values_list('id', 'post_id', 'text')
+    for pk, post_id, text in comments.iterator():
+        index_comment(pk, post_id, text)
+        indexed += 1
+    return indexed
+
+
+def matching_posts(query):
+    """Подзапрос id постов, в тексте которых есть все слова запроса."""
+    return RawSQL(
+        f'SELECT rowid FROM {POST_TABLE} WHERE {POST_TABLE} MATCH %s',
+        (match_query(query) or '""',)
+    )
+
+
+def matching_comments(query):
+    """Подзапрос id комментариев, в тексте которых есть все слова запроса."""
+    return RawSQL(
+        f'SELECT rowid FROM {COMMENT_TABLE} WHERE {COMMENT_TABLE} MATCH %s',
+        (match_query(query) or '""',)
+    )
+
+
+def encode_cursor(score, post_id):
+    raw = f'{score!r}|{post_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        score, post_id = raw.decode().split('|')
+        return float(score), int(post_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def ranked(match, key=None, limit=None):
+    """Пары (score, post_id) по убыванию релевантности.
+    Совпадение в комментарии поднимает его пост, но весит меньше.
+    Следующая страница начинается после ключа key, без OFFSET.
+    """
+    sql = (
+        'SELECT MIN(score) AS score, post_id FROM ('
+        f'SELECT bm25({POST_TABLE}) AS score, rowid AS post_id '
+        f'FROM {POST_TABLE} WHERE {POST_TABLE} MATCH %s '
+        'UNION ALL '
+        f'SELECT bm25({COMMENT_TABLE}) * %s, post_id '
+        f'FROM {COMMENT_TABLE} WHERE {COMMENT_TABLE} MATCH %s'
+        ') GROUP BY post_id'
+    )
+    params = [match, COMMENT_WEIGHT, match]
+    if key is not None:
+        sql += (
+            ' HAVING MIN(score) > %s OR (MIN(score) = %s AND post_id > %s)'
+        )
+        params += [key[0], key[0], key[1]]
+    sql += ' ORDER BY score, post_id LIMIT %s'
+    params.append(-1 if limit is None else limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def search_page(query, after=None):
+    """Страница результатов поиска по постам и комментариям."""
+    match = match_query(query)
+    if match is None:
+        return CursorPage([])
+    per_page = settings.NUMBER__OF_POSTS
+    key = decode_cursor(after) if after else None
+    rows = ranked(match, key, per_page + 1)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [post_id for _, post_id in rows]
+    )
+    return CursorPage(
+        [posts[post_id] for _, post_id in rows if post_id in posts],
+        next_cursor=encode_cursor(*rows[-1]) if has_more else None,
+    )
@@ -0,0 +1,152 @@
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_delete
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.generations import bump_generation
+
+from . import cards, counters, media, search, tasks, timeline
+from .models import Comment, Follow, Group, Post, User
+
+
+@receiver(post_init, sender=Post)
+def remember_counted(sender, instance, **kwargs):
+    instance._counted_group_id = instance.__dict__.get('group_id')
+    image = instance.__dict__.get('image')
+    instance._counted_image = getattr(image, 'name', image) or ''
+
+
+@receiver(post_save, sender=Post)
+def track_saved_post(sender, instance, created, **kwargs):
+    bump_generation('index_page')
+    search.index_post(instance.pk, instance.text)
+    if created:
+        counters.change(counters.post_scopes(instance, instance.group_id), 1)
+        # Лента недавних постов автора видна сразу, раскладка - позже.
+        cache.delete(timeline.recent_key(instance.author_id))
+        tasks.fan_out.delay(instance.pk)
+    else:
+        cards.bump('post', instance.pk)
+    if not created and instance._counted_group_id != instance.group_id:
+        if instance._counted_group_id:
+            counters.change(
+                [counters.scope('group', instance._counted_group_id)], -1
+            )
+        if instance.group_id:
+            counters.change([counters.scope('group', instance.group_id)], 1)
+    instance._counted_group_id = instance.group_id
+
+
+@receiver(post_save, sender=Post)
+def track_post_image(sender, instance, created, **kwargs):
+    image = instance.image.name or ''
+    if not created and instance._counted_image == image:
+        return
+    if not created and instance._counted_image:
+        media.release(instance._counted_image)
+    if image:
+        media.retain(image)
+    instance._counted_image = image
+
+
+@receiver(pre_delete, sender=Post)
+def retract_deleted_post(sender, instance, **kwargs):
+    instance._pulled = instance.author_id in timeline.pulled_author_ids()
+    if not instance._pulled:
+        timeline.retract_post(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def track_deleted_post(sender, instance, **kwargs):
+    bump_generation('index_page')
+    counters.change(
+        counters.post_scopes(instance, instance._counted_group_id), -1
+    )
+    cache.delete(timeline.recent_key(instance.author_id))
+    if instance._pulled:
+        tasks.retract.delay(instance.author_id)
+    search.unindex_post(instance.pk)
+    if instance._counted_image:
+        media.release(instance._counted_image)
+
+
+@receiver(post_save, sender=Follow)
+def track_follow(sender, instance, created, **kwargs):
+    if created:
+        timeline.count_follower(instance.author_id, 1)
+        counters.change([counters.scope('following', instance.user_id)], 1)
+        timeline.backfill(instance.user_id, instance.author_id)
+        counters.change(
+            [counters.scope('feed', instance.user_id)],
+            counters.get_count(
+                counters.scope('author', instance.author_id),
+                Post.objects.filter(author_id=instance.author_id)
+            )
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def track_unfollow(sender, instance, **kwargs):
+    if timeline.count_follower(instance.author_id, -1):
+        tasks.push_author.delay(instance.author_id)
+    counters.change([counters.scope('following', instance.user_id)], -1)
+    timeline.prune(instance.user_id, instance.author_id)
+    counters.change(
+        [counters.scope('feed', instance.user_id)],
+        -counters.get_count(
+            counters.scope('author', instance.author_id),
+            Post.objects.filter(author_id=instance.author_id)
+        )
+    )
+
+
+@receiver(post_save, sender=Comment)
+def track_comment(sender, instance, created, **kwargs):
+    bump_generation('comments')
+    search.index_comment(instance.pk, instance.post_id, instance.text)
+    # Правка комментария тоже меняет страницу поста и её ETag.
+    changes = {'updated_at': timezone.now()}
+    if created:
+        changes['comments_count'] = F('comments_count') + 1
+    Post.objects.filter(pk=instance.post_id).update(**changes)
+
+
+@receiver(post_delete, sender=Comment)
+def track_deleted_comment(sender, instance, **kwargs):
+    bump_generation('comments')
+    search.unindex_comment(instance.pk)
+    # Счётчик мог разойтись с базой, например после importdata
+    # без пересчёта, и уйти бы ниже нуля.
+    Post.objects.filter(pk=instance.post_id).update(
+        comments_count=Greatest(F('comments_count') - 1, 0),
+        updated_at=timezone.now()
+    )
+
+
+@receiver(post_save, sender=Group)
+def track_group(sender, instance, created, **kwargs):
+    if not created:
+        cards.bump('group', instance.pk)
+        bump_generation('index_page')
+
+
+@receiver(post_init, sender=User)
+def remember_username(sender, instance, **kwargs):
+    instance._shown_username = instance.__dict__.get('username')
+
+
+@receiver(post_save, sender=User)
+def track_user(sender, instance, created, update_fields=None, **kwargs):
+    if not created and update_fields != frozenset({'last_login'}):
+        cards.bump('user', instance.pk)
+        bump_generation('index_page')
+    if not created and instance._shown_username != instance.username:
+        # Имя автора видно и в комментариях под чужими постами.
+        Post.objects.filter(
+            pk__in=Comment.objects.filter(author=instance).values('post_id')
+        ).update(updated_at=timezone.now())
+    instance._shown_username = instance.username
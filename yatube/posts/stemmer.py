@@ -0,0 +1,113 @@
+"""Стеммер русского языка по алгоритму Snowball.
+Отрезает окончания, чтобы «постов», «посты» и «пост»
+попадали в поисковый индекс одним словом.
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+WORD = re.compile(r'\w+')
+
+PERFECTIVE_GERUND = (
+    ('в', 'вши', 'вшись'),
+    ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'),
+)
+ADJECTIVE = (
+    (),
+    (
+        'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем',
+        'им', 'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую',
+        'юю', 'ая', 'яя', 'ою', 'ею',
+    ),
+)
+PARTICIPLE = (
+    ('ем', 'нн', 'вш', 'ющ', 'щ'),
+    ('ивш', 'ывш', 'ующ'),
+)
+REFLEXIVE = ((), ('ся', 'сь'))
+VERB = (
+    (
+        'ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но',
+        'ет', 'ют', 'ны', 'ть', 'ешь', 'нно',
+    ),
+    (
+        'ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей',
+        'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят',
+        'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю',
+    ),
+)
+NOUN = (
+    (),
+    (
+        'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии',
+        'и', 'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам',
+        'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия',
+        'ья', 'я',
+    ),
+)
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+
+def _region(word, start=0):
+    """Начало области после первой согласной, следующей за гласной."""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _ending(word, start, endings):
+    """Самое длинное из окончаний, целиком лежащее в word[start:]."""
+    for ending in sorted(endings, key=len, reverse=True):
+        if word.endswith(ending) and len(word) - len(ending) >= start:
+            return ending
+    return None
+
+
+def _remove(word, start, group):
+    """Отрезает окончание группы или возвращает None.
+    Окончания первой половины группы отрезаются только после «а» или «я».
+    """
+    after_a, plain = group
+    ending = _ending(word, start, after_a + plain)
+    if ending is None:
+        return None
+    stem = word[:-len(ending)]
+    if ending not in plain and (len(stem) <= start or stem[-1] not in 'ая'):
+        return None
+    return stem
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    rv = next(
+        (i + 1 for i, char in enumerate(word) if char in VOWELS), len(word)
+    )
+    r2 = _region(word, _region(word))
+    stemmed = _remove(word, rv, PERFECTIVE_GERUND)
+    if stemmed is None:
+        word = _remove(word, rv, REFLEXIVE) or word
+        stemmed = _remove(word, rv, ADJECTIVE)
+        if stemmed is not None:
+            stemmed = _remove(stemmed, rv, PARTICIPLE) or stemmed
+        else:
+            stemmed = _remove(word, rv, VERB) or _remove(word, rv, NOUN)
+    word = stemmed or word
+    if word.endswith('и') and len(word) > rv:
+        word = word[:-1]
+    ending = _ending(word, r2, DERIVATIONAL)
+    if ending:
+        word = word[:-len(ending)]
+    ending = _ending(word, rv, SUPERLATIVE)
+    if ending:
+        word = word[:-len(ending)]
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    elif not ending and word.endswith('ь') and len(word) > rv:
+        word = word[:-1]
+    return word
+
+
+def stem_text(text):
+    """Основы всех слов текста через пробел."""
+    return ' '.join(stem(word) for word in WORD.findall(text))
@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from .media import image_storage
+from .models import Post
+from .thumbnails import forget, variants
+
+BATCH_SIZE = 500
+
+
+def walk(storage, directory):
+    """Файлы каталога хранилища рекурсивно.
+    В памяти держится только содержимое одного каталога.
+    """
+    try:
+        directories, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield os.path.join(directory, name).replace('\\', '/')
+    for name in directories:
+        yield from walk(storage, os.path.join(directory, name))
+
+
+def batches(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class RateLimiter:
+    """Не больше rate операций в секунду, None - без ограничения."""
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self.next_at = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if now < self.next_at:
+            time.sleep(self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+
+
+class Sweeper:
+    """Находит файлы картинок и вариантов, на которые не ссылается
+    ни один пост, и удаляет их с ограничением скорости.
+    Свежие файлы не трогаются: их пост может быть ещё не сохранён,
+    а вариант - ещё не создан.
+    """
+
+    def __init__(self, min_age=timedelta(hours=1), rate=None, dry_run=False,
+                 report=None):
+        self.min_age = min_age
+        self.limiter = RateLimiter(rate)
+        self.dry_run = dry_run
+        self.report = report
+        self.files = self.bytes = 0
+
+    def old_enough(self, storage, name):
+        modified = storage.get_modified_time(name)
+        return timezone.now() - modified >= self.min_age
+
+    def orphaned_images(self):
+        storage = image_storage()
+        directory = Post._meta.get_field('image').upload_to.rstrip('/')
+        for batch in batches(walk(storage, directory)):
+            referenced = set(
+                Post.objects.filter(image__in=batch).values_list(
+                    'image', flat=True
+                )
+            )
+            for name in batch:
+                if name not in referenced and self.old_enough(storage, name):
+                    yield name
+
+    def orphaned_thumbnails(self, live):
+        storage = default.storage
+        directory = thumbnail_settings.THUMBNAIL_PREFIX.rstrip('/')
+        for batch in batches(walk(storage, directory)):
+            found = {
+                name for name, in live.execute(
+                    'SELECT name FROM live WHERE name IN ({})'.format(
+                        ','.join('?' * len(batch))
+                    ),
+                    batch
+                )
+            }
+            for name in batch:
+                if name not in found and self.old_enough(storage, name):
+                    yield name
+
+    def live_thumbnails(self, path):
+        """Имена вариантов всех картинок постов во временной базе на диске,
+        чтобы не держать их в памяти.
+        """
+        live = sqlite3.connect(path)
+        live.execute('CREATE TABLE live (name TEXT PRIMARY KEY)')
+        posts = Post.objects.exclude(image='').only('image').iterator()
+        for batch in batches(posts):
+            live.executemany(
+                'INSERT OR IGNORE INTO live VALUES (?)',
+                [
+                    (default.backend.prepare(
+                        post.image, geometry, **options
+                    )[1].name,)
+                    for post in batch
+                    for geometry, options in variants()
+                ]
+            )
+            live.commit()
+        return live
+
+    def delete(self, storage, name):
+        self.files += 1
+        self.bytes += storage.size(name)
+        if self.report is not None:
+            self.report(name)
+        if self.dry_run:
+            return
+        self.limiter.wait()
+        storage.delete(name)
+
+    def sweep(self):
+        """Удаляет ненужные файлы, при dry_run только считает их.
+        Возвращает число файлов и их общий размер в байтах.
+        """
+        storage = image_storage()
+        for name in self.orphaned_images():
+            # Ту же картинку могли загрузить заново, пока шёл обход.
+            if (
+                not self.old_enough(storage, name)
+                or Post.objects.filter(image=name).exists()
+            ):
+                continue
+            self.delete(storage, name)
+            if not self.dry_run:
+                default.kvstore.delete(ImageFile(name, storage))
+                forget(name)
+        with tempfile.TemporaryDirectory() as directory:
+            live = self.live_thumbnails(os.path.join(directory, 'live.db'))
+            try:
+                for name in self.orphaned_thumbnails(live):
+                    self.delete(default.storage, name)
+            finally:
+                live.close()
+        return self.files, self.bytes
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from core.tasks import task
+
+from . import timeline
+from .models import Post
+from .sweeper import Sweeper
+
+
+@task(priority=10)
+def fan_out(post_id):
+    post = Post.objects.filter(pk=post_id).first()
+    if post is not None:
+        timeline.fan_out(post)
+
+
+@task(priority=10)
+def retract(author_id):
+    timeline.retract(author_id)
+
+
+@task(priority=5)
+def push_author(author_id):
+    timeline.push_author(author_id)
+
+
+@task(priority=-10, max_attempts=1)
+def sweep_media():
+    Sweeper(min_age=timedelta(days=1), rate=50).sweep()
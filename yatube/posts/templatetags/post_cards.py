@@ -0,0 +1,15 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from ..cards import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_cards(posts, author_link=False, groups_posts_link=False):
+    """HTML карточек постов страницы, из кэша или отрендеренный."""
+    return [
+        mark_safe(card)
+        for card in render_cards(posts, author_link, groups_posts_link)
+    ]
@@ -0,0 +1,15 @@
+from django import template
+
+from ..thumbnails import resolve
+
+register = template.Library()
+
+
+@register.inclusion_tag('includes/post_image.html')
+def post_image(image, picture=None):
+    """Адаптивная картинка поста: WebP и JPEG нескольких ширин.
+    Страница может передать данные, уже собранные для всех постов разом.
+    """
+    if picture is None:
+        picture = resolve([image])[image.name]
+    return picture
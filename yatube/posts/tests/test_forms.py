@@ -1,11 +1,23 @@
+import hashlib
+import json
+import os
 import shutil
 import tempfile
+import zipfile
+from io import BytesIO, StringIO
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image, features
+from sorl.thumbnail import default
 
+from .. import archive, checks, media, thumbnails
 from ..models import Comment, Group, Post, User
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -54,6 +66,8 @@ class PostCreateFormTests(TestCase):
             b'\x02\x00\x01\x00\x00\x02\x02\x0C'
             b'\x0A\x00\x3B'
         )
+        digest = hashlib.sha256(self.image).hexdigest()
+        self.image_name = f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif'
         self.URL_INDEX = ('posts:index', None)
         self.URL_DETAIL = ('posts:post_detail', (self.post.id,))
         self.URL_GROUP = ('posts:group_list', (self.group.slug,))
@@ -85,9 +99,7 @@ class PostCreateFormTests(TestCase):
         )
         self.assertEqual(Post.objects.count(), posts_count + 1)
         post = Post.objects.first()
-        self.assertIn(
-            form_data['image'].name, post.image.name
-        )
+        self.assertEqual(post.image.name, self.image_name)
         self.assertEqual(post.text, form_data['text'])
         self.assertEqual(post.group.id, form_data['group'])
         self.assertEqual(post.author, self.user)
@@ -120,9 +132,267 @@ class PostCreateFormTests(TestCase):
         self.assertEqual(response.context['post'].text, form_data['text'])
         self.assertEqual(response.context['post'].group.id, form_data['group'])
         self.assertEqual(post.author, self.post.author)
+        self.assertEqual(post.image.name, self.image_name)
+
+    @override_settings(THUMBNAIL_WORKERS=1)
+    def test_thumbnails_backfill(self):
+        """Команда создаёт недостающие варианты в пуле процессов,
+        а шаблон получает готовые srcset и заглушку."""
+        post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='image_3.gif',
+                content=self.image.replace(b'\xFF\xFF\xFF', b'\x00\x00\xFF'),
+                content_type='image/gif'
+            )
+        )
+        out = StringIO()
+        call_command('generate_thumbnails', stdout=out)
         self.assertIn(
-            form_data['image'].name, post.image.name
+            f'Создано миниатюр: {len(thumbnails.variants())}',
+            out.getvalue()
+        )
+        for geometry, options in thumbnails.variants():
+            with self.subTest(geometry=geometry, options=options):
+                _, thumbnail, _ = default.backend.prepare(
+                    post.image, geometry, **options
+                )
+                self.assertTrue(thumbnail.exists())
+        response = self.guest_client.get(
+            reverse(self.URL_DETAIL[0], args=(post.id,))
+        )
+        self.assertContains(response, 'srcset=')
+        self.assertContains(response, 'data:image/jpeg;base64,')
+        webp = features.check('webp')
+        self.assertEqual(b'type="image/webp"' in response.content, webp)
+        self.assertEqual(bool(checks.webp_support(None)), not webp)
+        picture = cache.get(thumbnails.picture_key(post.image.name))
+        self.assertIsNotNone(picture)
+        self.assertEqual(
+            thumbnails.resolve([post.image]), {post.image.name: picture}
+        )
+
+    def test_same_image_stored_once(self):
+        """Одинаковые загрузки хранятся одним файлом,
+        который удаляется вместе с последним ссылающимся постом."""
+        posts = [
+            Post.objects.create(
+                author=self.user,
+                text=f'Пост {name}',
+                image=SimpleUploadedFile(
+                    name=name, content=self.image, content_type='image/gif'
+                )
+            )
+            for name in ('first.gif', 'second.GIF')
+        ]
+        self.assertEqual(
+            {post.image.name for post in posts}, {self.image_name}
+        )
+        path = posts[0].image.path
+        self.assertEqual(media.references(self.image_name), 2)
+        posts[0].delete()
+        media.delete_unused(self.image_name)
+        self.assertTrue(os.path.exists(path))
+        posts[1].delete()
+        self.assertEqual(media.references(self.image_name), 0)
+        # Такую же картинку могли только что загрузить снова.
+        media.delete_unused(self.image_name)
+        self.assertTrue(os.path.exists(path))
+        with override_settings(MEDIA_DELETE_GRACE=0):
+            media.delete_unused(self.image_name)
+        self.assertFalse(os.path.exists(path))
+
+    def test_shard_media(self):
+        """Команда переносит старые файлы в подкаталоги по хешу."""
+        post = Post.objects.create(author=self.user, text='Старый пост')
+        legacy = FileSystemStorage().save(
+            'posts/legacy.gif', ContentFile(self.image)
+        )
+        Post.objects.filter(pk=post.pk).update(image=legacy)
+        out = StringIO()
+        call_command('shard_media', '--dry-run', stdout=out)
+        self.assertIn('Нужно перенести файлов: 1', out.getvalue())
+        call_command('shard_media', stdout=out)
+        post.refresh_from_db()
+        self.assertEqual(post.image.name, self.image_name)
+        self.assertTrue(os.path.exists(post.image.path))
+        call_command('shard_media', '--dry-run', stdout=out)
+        self.assertIn('Нужно перенести файлов: 0', out.getvalue())
+
+    def test_sweep_media(self):
+        """Сборщик удаляет только файлы без ссылок из постов."""
+        post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='kept.gif', content=self.image, content_type='image/gif'
+            )
+        )
+        thumbnails.backfill([post.image])
+        kept = [
+            default.backend.prepare(post.image, geometry, **options)[1]
+            for geometry, options in thumbnails.variants()
+        ]
+        storage = FileSystemStorage()
+        orphan = storage.save('posts/orphan.gif', ContentFile(b'orphan'))
+        stale = storage.save('cache/00/stale.jpg', ContentFile(b'stale'))
+        out = StringIO()
+        call_command('sweep_media', '--dry-run', '--min-age=0', stdout=out)
+        self.assertIn(orphan, out.getvalue())
+        self.assertIn(stale, out.getvalue())
+        self.assertIn('Будет удалено файлов:', out.getvalue())
+        self.assertTrue(storage.exists(orphan))
+        call_command('sweep_media', '--min-age=0', '--rate=0', stdout=out)
+        self.assertFalse(storage.exists(orphan))
+        self.assertFalse(storage.exists(stale))
+        self.assertTrue(storage.exists(post.image.name))
+        for thumbnail in kept:
+            self.assertTrue(thumbnail.exists())
+        call_command('sweep_media', stdout=out)
+        self.assertIn('Удалено файлов: 0', out.getvalue())
+
+    @override_settings(IMAGE_MAX_SIDE=100)
+    def test_upload_downscaled_without_exif(self):
+        """Большое фото уменьшается и сохраняется без EXIF."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Телефон'
+        photo = BytesIO()
+        Image.new('RGB', (400, 40), 'red').save(
+            photo, 'JPEG', exif=exif.tobytes()
+        )
+        self.authorized_client.post(
+            reverse(self.CTEATE_URL[0]),
+            data={
+                'text': 'Пост с фото',
+                'image': SimpleUploadedFile(
+                    'photo.jpg', photo.getvalue(), content_type='image/jpeg'
+                ),
+            }
+        )
+        post = Post.objects.get(text='Пост с фото')
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (100, 10))
+            self.assertNotIn('exif', image.info)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_upload_animation_stripped_of_exif(self):
+        """Анимация из временного файла загрузки остаётся анимацией,
+        но теряет EXIF."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Телефон'
+        animation = BytesIO()
+        frames = [
+            Image.new('RGB', (40, 40), color)
+            for color in ('red', 'green', 'blue')
+        ]
+        frames[0].save(
+            animation, 'PNG', save_all=True, append_images=frames[1:],
+            exif=exif.tobytes()
+        )
+        self.authorized_client.post(
+            reverse(self.CTEATE_URL[0]),
+            data={
+                'text': 'Пост с анимацией',
+                'image': SimpleUploadedFile(
+                    'frames.png', animation.getvalue(),
+                    content_type='image/png'
+                ),
+            }
+        )
+        post = Post.objects.get(text='Пост с анимацией')
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.n_frames, 3)
+            self.assertNotIn('exif', image.info)
+
+    @override_settings(IMAGE_MAX_SIDE=10)
+    def test_upload_unwritable_format_converted(self):
+        """Картинка в формате, который Pillow не пишет, сохраняется
+        в JPEG, а не роняет форму."""
+        xpm = (
+            '/* XPM */\n'
+            'static char *image[] = {\n'
+            '"20 1 1 1",\n'
+            '"a c #FF0000",\n'
+            f'"{"a" * 20}"\n'
+            '};\n'
+        )
+        response = self.authorized_client.post(
+            reverse(self.CTEATE_URL[0]),
+            data={
+                'text': 'Пост с XPM',
+                'image': SimpleUploadedFile(
+                    'picture.xpm', xpm.encode(),
+                    content_type='image/x-xpixmap'
+                ),
+            }
+        )
+        self.assertEqual(response.status_code, 302)
+        post = Post.objects.get(text='Пост с XPM')
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (10, 1))
+
+    @override_settings(UPLOAD_MAX_SIZE=16)
+    def test_upload_too_large(self):
+        """Файл больше лимита отклоняется формой."""
+        posts_count = Post.objects.count()
+        response = self.authorized_client.post(
+            reverse(self.CTEATE_URL[0]),
+            data={
+                'text': 'Пост с большой картинкой',
+                'image': SimpleUploadedFile(
+                    'big.gif', self.image, content_type='image/gif'
+                ),
+            }
+        )
+        self.assertEqual(Post.objects.count(), posts_count)
+        self.assertFormError(
+            response, 'form', 'image', 'Файл больше 0 МБ'
+        )
+
+    def test_profile_archive(self):
+        """Автор скачивает ZIP со своими постами, комментариями
+        и картинками, число одновременных архивов ограничено."""
+        post = Post.objects.create(
+            author=self.user,
+            text='Пост в архив',
+            image=SimpleUploadedFile(
+                'archive.gif', self.image, content_type='image/gif'
+            )
+        )
+        Comment.objects.create(post=self.post, author=self.user, text='Мой')
+        url = reverse('posts:profile_archive', args=(self.user.username,))
+        response = self.authorized_client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(
+            BytesIO(b''.join(response.streaming_content))
+        ) as result:
+            posts = [
+                json.loads(line)
+                for line in result.read('posts.ndjson').splitlines()
+            ]
+            self.assertEqual([record['id'] for record in posts], [post.pk])
+            self.assertEqual(
+                json.loads(result.read('comments.ndjson'))['text'], 'Мой'
+            )
+            self.assertEqual(
+                result.read(f'images/{self.image_name}'), self.image
+            )
+        self.assertRedirects(
+            self.authorized_author_client.get(url),
+            reverse('posts:profile', args=(self.user.username,))
         )
+        with override_settings(ARCHIVE_MAX_JOBS=1):
+            archive._slots = None
+            busy = archive.Archive.start(self.user)
+            self.assertEqual(self.authorized_client.get(url).status_code, 503)
+            busy.close()
+            response = self.authorized_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+        archive._slots = None
 
     def test_post_edit_guest(self):
         """Проверка изменения поста
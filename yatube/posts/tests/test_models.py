@@ -1,6 +1,13 @@
-from django.test import TestCase
+from io import StringIO
 
-from ..models import Group, Post, User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core import tasks
+
+from .. import counters
+from ..models import Comment, Counter, Follow, Group, Post, User
+from ..timeline import fan_out
 
 
 class PostModelTest(TestCase):
@@ -54,3 +61,130 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expected_value)
+
+
+class CounterTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.follower = User.objects.create_user(username='follower')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Post.objects.create(author=cls.author, text='Тест', group=cls.group)
+
+    def get_counts(self):
+        return {
+            name: counters.get_count(name, queryset)
+            for name, queryset in (
+                ('posts', Post.objects.all()),
+                (f'group:{self.group.pk}', self.group.posts.all()),
+                (f'author:{self.author.pk}', self.author.posts.all()),
+                (
+                    f'feed:{self.follower.pk}',
+                    Post.objects.filter(
+                        author__following__user=self.follower
+                    )
+                ),
+            )
+        }
+
+    def test_counters_follow_posts_and_subscriptions(self):
+        """Счётчики меняются при создании, переносе
+        и удалении постов и при подписке."""
+        self.assertEqual(set(self.get_counts().values()), {1, 0})
+        Follow.objects.create(user=self.follower, author=self.author)
+        post = Post.objects.create(author=self.author, text='Тест 2')
+        self.assertEqual(set(self.get_counts().values()), {2, 1})
+        post.group = self.group
+        post.save()
+        self.assertEqual(set(self.get_counts().values()), {2})
+        post.delete()
+        self.assertEqual(set(self.get_counts().values()), {1})
+        Follow.objects.all().delete()
+        self.assertEqual(
+            self.get_counts()[f'feed:{self.follower.pk}'], 0
+        )
+
+    @override_settings(TASKS_EAGER=False, TIMELINE_BATCH_SIZE=2)
+    def test_feed_counters_follow_fan_out(self):
+        """Счётчики лент подписчиков сдвигает задача раскладки
+        пачками, а не сохранение поста, и удаление поста только
+        в тех лентах, куда он разложен."""
+        followers = [self.follower] + [
+            User.objects.create_user(username=f'reader{number}')
+            for number in range(2)
+        ]
+        for user in followers:
+            Follow.objects.create(user=user, author=self.author)
+
+        def feed_counts():
+            return {
+                counters.get_count(
+                    f'feed:{user.pk}',
+                    Post.objects.filter(author__following__user=user)
+                )
+                for user in followers
+            }
+
+        self.assertEqual(feed_counts(), {1})
+        post = Post.objects.create(author=self.author, text='Новый')
+        self.assertEqual(feed_counts(), {1})
+        while tasks.run_next('test'):
+            pass
+        self.assertEqual(feed_counts(), {2})
+        fan_out(post)
+        self.assertEqual(feed_counts(), {2})
+        post.delete()
+        while tasks.run_next('test'):
+            pass
+        self.assertEqual(feed_counts(), {1})
+        # Пост, не дошедший до лент, их счётчики не уменьшает.
+        Post.objects.create(author=self.author, text='Не разложен').delete()
+        while tasks.run_next('test'):
+            pass
+        self.assertEqual(feed_counts(), {1})
+
+    def test_recount_repairs_drift(self):
+        """recount исправляет расхождение счётчиков."""
+        self.get_counts()
+        Counter.objects.update(value=100)
+        counters.recount()
+        self.assertEqual(set(self.get_counts().values()), {1, 0})
+
+    def test_comments_and_user_counters(self):
+        """Число комментариев поста и подписок пользователя
+        хранится и поддерживается при изменениях."""
+        post = Post.objects.get()
+        comment = Comment.objects.create(
+            post=post, author=self.follower, text='Комментарий'
+        )
+        Comment.objects.create(post=post, author=self.author, text='Ещё')
+        comment.delete()
+        Follow.objects.create(user=self.follower, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(
+            counters.user_counts(self.author.pk),
+            {'posts': 1, 'followers': 1, 'following': 0}
+        )
+        self.assertEqual(
+            counters.user_counts(self.follower.pk),
+            {'posts': 0, 'followers': 0, 'following': 1}
+        )
+        Post.objects.update(comments_count=0)
+        Comment.objects.filter(author=self.author).delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        Comment.objects.create(post=post, author=self.author, text='Ещё')
+        Post.objects.update(comments_count=10)
+        Counter.objects.update(value=10)
+        call_command('recount', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(
+            counters.user_counts(self.follower.pk)['following'], 1
+        )
@@ -0,0 +1,241 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from core.generations import get_generation
+
+from .. import search, timeline
+from ..models import Comment, Counter, Follow, Group, Post, Timeline, User
+from ..transfer import Importer
+
+
+class ImportDataTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.user = User.objects.create_user(username='auth')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def ndjson(self, name, records):
+        return self.write(
+            name, ''.join(json.dumps(record) + '\n' for record in records)
+        )
+
+    def test_import_posts_comments_follows(self):
+        """Загрузка сохраняет id и даты, создаёт недостающих авторов
+        и группы и пересчитывает счётчики, ленты и поиск."""
+        posts = self.ndjson('posts.ndjson', [
+            {'id': 100, 'author': 'auth', 'group': 'imported',
+             'text': 'Импортированный пост',
+             'pub_date': '2020-01-02T03:04:05+00:00'},
+            {'id': 101, 'author': 'newcomer', 'text': 'Второй пост'},
+            {'id': 102, 'author': 'auth', 'text': ''},
+        ])
+        comments = self.write(
+            'comments.csv',
+            'id,post,author,text,created\n'
+            '500,100,newcomer,"Первый, с запятой",2020-01-03T00:00:00\n'
+            '501,999,auth,К несуществующему посту,\n'
+        )
+        follows = self.ndjson('follows.ndjson', [
+            {'user': 'auth', 'author': 'newcomer'},
+            {'user': 'auth', 'author': 'auth'},
+        ])
+        out = StringIO()
+        call_command('importdata', 'posts', posts, stdout=out)
+        self.assertIn('Загружено строк: 2, пропущено: 1', out.getvalue())
+        call_command('importdata', 'comments', comments, stdout=out)
+        self.assertIn('Загружено строк: 1, пропущено: 1', out.getvalue())
+        call_command('importdata', 'follows', follows, stdout=out)
+        post = Post.objects.get(pk=100)
+        self.assertEqual(post.pub_date.year, 2020)
+        self.assertEqual(post.group, Group.objects.get(slug='imported'))
+        newcomer = User.objects.get(username='newcomer')
+        self.assertFalse(newcomer.has_usable_password())
+        self.assertEqual(Comment.objects.get(pk=500).post, post)
+        self.assertEqual(Post.objects.get(pk=100).comments_count, 1)
+        self.assertTrue(
+            Follow.objects.filter(user=self.user, author=newcomer).exists()
+        )
+        self.assertEqual(
+            Counter.objects.get(scope=f'author:{self.user.pk}').value, 1
+        )
+        self.assertTrue(
+            Timeline.objects.filter(user=self.user, post_id=101).exists()
+        )
+        self.assertEqual(
+            search.search_page('импортированный').object_list, [post]
+        )
+        self.assertFalse(os.path.exists(posts + '.checkpoint'))
+        self.assertGreater(
+            Post.objects.create(author=self.user, text='Новый').pk, 101
+        )
+
+    def test_repeated_import_counts_only_new_rows(self):
+        """Повторная загрузка и дубли в файле не считаются
+        загруженными и не трогают уже загруженные посты."""
+        path = self.ndjson('posts.ndjson', [
+            {'id': 300, 'author': 'auth', 'text': 'Первый пост'},
+            {'id': 300, 'author': 'auth', 'text': 'Дубль'},
+            {'author': 'auth', 'text': 'Пост без id'},
+        ])
+        self.assertEqual(Importer('posts', path).run(), (2, 1))
+        self.assertEqual(
+            search.search_page('без').object_list,
+            [Post.objects.get(text='Пост без id')]
+        )
+        path = self.ndjson('posts.ndjson', [
+            {'id': 300, 'author': 'auth', 'text': 'Другой текст'},
+            {'id': 400, 'author': 'auth', 'text': 'Второй пост'},
+        ])
+        self.assertEqual(Importer('posts', path).run(), (1, 1))
+        self.assertEqual(Post.objects.get(pk=300).text, 'Первый пост')
+        self.assertEqual(search.search_page('другой').object_list, [])
+
+    @override_settings(FEED_PULL_THRESHOLD=1)
+    def test_import_refreshes_pulled_authors_and_generations(self):
+        """Посты тянущегося автора сразу видны в недавних постах,
+        а поколения API меняются и без пересчёта."""
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.user)
+        self.assertIn(self.user.pk, timeline.pulled_author_ids())
+        self.assertEqual(
+            timeline.recent_posts([self.user.pk]), {self.user.pk: []}
+        )
+        generation = get_generation('comments')
+        path = self.ndjson('posts.ndjson', [
+            {'id': 600, 'author': 'auth', 'text': 'Пост популярного автора'},
+        ])
+        call_command(
+            'importdata', 'posts', path, '--no-rebuild', stdout=StringIO()
+        )
+        recent = timeline.recent_posts([self.user.pk])[self.user.pk]
+        self.assertEqual([pk for _, pk in recent], [600])
+        self.assertFalse(Timeline.objects.filter(post_id=600).exists())
+        self.assertNotEqual(get_generation('comments'), generation)
+
+    def test_resume_from_checkpoint(self):
+        """Прерванная загрузка продолжается с сохранённой позиции."""
+        path = self.ndjson('posts.ndjson', [
+            {'id': 200 + number, 'author': 'auth', 'text': f'Пост {number}'}
+            for number in range(5)
+        ])
+        checkpoint = path + '.checkpoint'
+        with open(path, 'rb') as file:
+            offset = len(file.readline()) + len(file.readline())
+        with open(checkpoint, 'w') as file:
+            json.dump({'offset': offset, 'imported': 2, 'skipped': 0}, file)
+        imported, _ = Importer(
+            'posts', path, batch_size=2, checkpoint=checkpoint
+        ).run()
+        self.assertEqual(imported, 5)
+        self.assertEqual(
+            set(Post.objects.values_list('pk', flat=True)), {202, 203, 204}
+        )
+
+
+class ExportDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        cls.posts = [
+            Post.objects.create(
+                author=cls.user, group=cls.group, text=f'Пост {number}'
+            )
+            for number in range(5)
+        ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_export_round_trip(self):
+        """Выгрузка читается importdata без потерь."""
+        path = os.path.join(self.directory, 'posts.ndjson')
+        call_command(
+            'exportdata', 'posts', path, '--chunk-size=2', stdout=StringIO()
+        )
+        Post.objects.all().delete()
+        call_command('importdata', 'posts', path, stdout=StringIO())
+        self.assertEqual(
+            list(Post.objects.order_by('pk').values_list(
+                'pk', 'author', 'group', 'text', 'pub_date'
+            )),
+            [
+                (post.pk, self.user.pk, self.group.pk, post.text,
+                 post.pub_date)
+                for post in self.posts
+            ]
+        )
+
+    def test_export_resume(self):
+        """Прерванная выгрузка в gzip дописывается с последней пачки."""
+        path = os.path.join(self.directory, 'posts.ndjson.gz')
+        with open(path, 'wb') as file:
+            file.write(gzip.compress(
+                json.dumps({'id': self.posts[0].pk}).encode() + b'\n'
+            ))
+            size = file.tell()
+            file.write(b'\x1f\x8b oborvano')
+        with open(path + '.resume', 'w') as file:
+            json.dump({'after': self.posts[0].pk, 'size': size}, file)
+        call_command(
+            'exportdata', 'posts', path, '--gzip', '--resume',
+            '--chunk-size=2', stdout=StringIO()
+        )
+        self.assertEqual(
+            [record['id'] for record in self.read(path)],
+            [post.pk for post in self.posts]
+        )
+        self.assertFalse(os.path.exists(path + '.resume'))
+
+    def test_export_endpoint(self):
+        """Выгрузка по HTTP доступна только персоналу
+        и продолжается с переданного id."""
+        url = reverse('posts:export', args=('posts',))
+        client = Client()
+        client.force_login(self.user)
+        self.assertEqual(client.get(url).status_code, 302)
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        client.force_login(staff)
+        response = client.get(
+            url, {'gzip': 1, 'after': self.posts[2].pk}
+        )
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        records = [
+            json.loads(line) for line in gzip.decompress(
+                b''.join(response.streaming_content)
+            ).decode().splitlines()
+        ]
+        self.assertEqual(
+            [record['id'] for record in records],
+            [post.pk for post in self.posts[3:]]
+        )
+        self.assertEqual(records[0]['group'], 'group')
+        self.assertEqual(
+            client.get(reverse('posts:export', args=('users',))).status_code,
+            404
+        )
@@ -1,11 +1,18 @@
+from io import StringIO
+
 from django import forms
 from django.conf import settings
 from django.core.cache import cache
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
+from core import metrics, tasks
+from core.testing import QueryBudgetMixin
+
 from ..forms import PostForm
-from ..models import Follow, Group, Post, User
+from ..models import Comment, Counter, Follow, Group, Post, Timeline, User
+from ..utils import encode_cursor
 
 
 class PostPagesTests(TestCase):
@@ -122,16 +129,112 @@ class PostPagesTests(TestCase):
         self.assertEqual(author.username, self.user.username)
         self.assertEqual(author.id, self.user.id)
 
+    def test_post_card_cache(self):
+        """Карточка поста берётся из кэша и обновляется
+        при изменении поста, группы или имени автора."""
+        url = reverse(self.URL_GROUP[0], args=self.URL_GROUP[1])
+        self.authorized_client.get(url)
+        self.authorized_client.get(url)
+        self.assertEqual(metrics.snapshot()['cards.hits'], 1)
+        self.assertEqual(metrics.snapshot()['cards.misses'], 1)
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Изменённый пост'
+        post.save()
+        self.assertContains(self.authorized_client.get(url), 'Изменённый пост')
+        author = User.objects.get(pk=self.user.pk)
+        author.first_name = 'Лев'
+        author.save()
+        self.assertContains(self.authorized_client.get(url), 'Лев')
+        self.assertEqual(metrics.snapshot()['cards.misses'], 3)
+
     def test_index_page_cache(self):
+        """Главная страница кэшируется, пока посты не меняются,
+        и сбрасывается сразу после изменения."""
         response1 = self.authorized_client.get(reverse(self.URL_INDEX[0]))
-        Post.objects.all().delete()
+        Post.objects.update(text='Изменено в обход сигналов')
         response2 = self.authorized_client.get(reverse(self.URL_INDEX[0]))
         self.assertEqual(response1.content, response2.content)
-        cache.clear()
-        response_clear_cache = self.authorized_client.get(
+        Post.objects.all().delete()
+        response_after_delete = self.authorized_client.get(
             reverse(self.URL_INDEX[0])
         )
-        self.assertNotEqual(response1, response_clear_cache)
+        self.assertNotEqual(response1.content, response_after_delete.content)
+        self.assertEqual(len(response_after_delete.context['page_obj']), 0)
+
+    def test_post_detail_etag(self):
+        """Страница поста с прежним ETag отдаётся как 304 одним запросом.
+        ETag меняется после комментария и правки и разный
+        у гостя и автора."""
+        url = reverse(self.URL_DETAIL[0], args=self.URL_DETAIL[1])
+        self.authorized_client.get(url)
+        etag = self.authorized_client.get(url)['ETag']
+        self.assertIn('Cookie', self.authorized_client.get(url)['Vary'])
+        with self.assertNumQueries(3):
+            # Запрос ETag и сессия с пользователем.
+            response = self.authorized_client.get(
+                url, HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(Client().get(url)['ETag'], etag)
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий'
+        )
+        commented = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(commented.status_code, 200)
+        self.assertContains(commented, 'Комментарий')
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Изменённый пост'
+        post.save()
+        edited = self.authorized_client.get(url)['ETag']
+        self.assertNotEqual(edited, commented['ETag'])
+        comment = Comment.objects.get(post=self.post)
+        comment.text = 'Исправленный комментарий'
+        comment.save()
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=edited)
+        self.assertContains(response, 'Исправленный комментарий')
+        commenter = User.objects.create_user(username='commenter')
+        Comment.objects.create(
+            post=self.post, author=commenter, text='Ещё комментарий'
+        )
+        etag = self.authorized_client.get(url)['ETag']
+        updated_at = Post.objects.get(pk=self.post.pk).updated_at
+        commenter.set_password('новый пароль')
+        commenter.save()
+        self.assertEqual(
+            Post.objects.get(pk=self.post.pk).updated_at, updated_at
+        )
+        commenter.username = 'renamed'
+        commenter.save()
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'renamed')
+
+    @override_settings(COMMENTS_PER_PAGE=2)
+    def test_post_detail_comments_by_chunks(self):
+        """Страница поста показывает первую порцию комментариев,
+        остальные догружаются фрагментами по курсору."""
+        for number in range(5):
+            Comment.objects.create(
+                post=self.post, author=self.user, text=f'Комментарий {number}'
+            )
+        url = reverse(self.URL_DETAIL[0], args=self.URL_DETAIL[1])
+        texts = []
+        while url:
+            response = self.authorized_client.get(url)
+            texts += [comment.text for comment in response.context['comments']]
+            url = response.context['next_cursor'] and (
+                reverse('posts:post_comments', args=(self.post.pk,))
+                + '?after=' + response.context['next_cursor']
+            )
+        self.assertEqual(
+            texts, [f'Комментарий {number}' for number in range(5)]
+        )
+        self.assertNotContains(response, 'Показать ещё')
+        self.assertEqual(
+            self.authorized_client.get(
+                reverse('posts:post_comments', args=(0,))
+            ).status_code,
+            404
+        )
 
 
 class PaginatorViewsTest(TestCase):
@@ -163,6 +266,7 @@ class PaginatorViewsTest(TestCase):
         self.URL_PROFILE = ('posts:profile', (self.author,))
         self.URL_FOLLOWER = ('posts:follow_index', None)
 
+        cache.clear()
         self.authorized_user.get(
             reverse(
                 'posts:profile_follow',
@@ -196,6 +300,102 @@ class PaginatorViewsTest(TestCase):
                             nums
                         )
 
+    def test_cursor_paginator_on_pages(self):
+        """Курсорная пагинация листает ленту
+        вперёд и назад без номеров страниц."""
+        urls = (
+            self.URL_INDEX,
+            self.URL_GROUP,
+            self.URL_PROFILE,
+            self.URL_FOLLOWER,
+        )
+        for url, args in urls:
+            with self.subTest(url=url):
+                address = reverse(url, args=args)
+                first_page = self.authorized_user.get(
+                    address + '?page=1'
+                ).context['page_obj']
+                second_page = self.authorized_user.get(
+                    address + f'?after={first_page.next_cursor}'
+                ).context['page_obj']
+                self.assertEqual(
+                    len(second_page),
+                    settings.TOTAL_NUMBER_OF_POSTS_IN_PAGINATOR
+                    - settings.NUMBER__OF_POSTS
+                )
+                self.assertFalse(second_page.has_next())
+                self.assertEqual(second_page[0], Post.objects.all()[10])
+                previous_page = self.authorized_user.get(
+                    address + f'?before={second_page.previous_cursor}'
+                ).context['page_obj']
+                self.assertEqual(
+                    list(previous_page), list(first_page)
+                )
+                self.assertFalse(previous_page.has_previous())
+
+    def test_paginator_page_out_of_range(self):
+        """Номер за концом ленты открывает последнюю страницу,
+        нечисловой - первую."""
+        address = reverse(self.URL_GROUP[0], args=self.URL_GROUP[1])
+        for page, number in (('?page=100', 2), ('?page=0', 2),
+                             ('?page=x', 1)):
+            with self.subTest(page=page):
+                response = self.authorized_user.get(address + page)
+                self.assertEqual(response.context['page_obj'].number, number)
+
+    @override_settings(PAGINATOR_EXACT_COUNT_LIMIT=1)
+    def test_paginator_shows_estimated_pages(self):
+        """Для больших лент число страниц показывается примерно."""
+        response = self.authorized_user.get(
+            reverse(self.URL_GROUP[0], args=self.URL_GROUP[1])
+        )
+        self.assertTrue(response.context['page_obj'].paginator.estimated)
+        self.assertContains(response, 'около 2 стр.')
+
+    @override_settings(PAGINATOR_COUNTERS=False)
+    def test_limit_paginator_on_pages(self):
+        """Без счётчиков пагинатор узнаёт о следующей странице
+        по лишней записи."""
+        address = reverse(self.URL_INDEX[0])
+        first_page = self.authorized_user.get(
+            address + '?page=1'
+        ).context['page_obj']
+        self.assertTrue(first_page.has_next())
+        last_page = self.authorized_user.get(
+            address + '?page=2'
+        ).context['page_obj']
+        self.assertFalse(last_page.has_next())
+        self.assertEqual(
+            len(last_page),
+            settings.TOTAL_NUMBER_OF_POSTS_IN_PAGINATOR
+            - settings.NUMBER__OF_POSTS
+        )
+        missing_page = self.authorized_user.get(
+            address + '?page=100'
+        ).context['page_obj']
+        self.assertEqual(missing_page.number, 2)
+        self.assertEqual(list(missing_page), list(last_page))
+
+    def test_broken_cursor_opens_first_page(self):
+        """Битый курсор открывает начало ленты."""
+        response = self.authorized_user.get(
+            reverse(self.URL_INDEX[0]) + '?after=broken'
+        )
+        self.assertEqual(
+            len(response.context['page_obj']), settings.NUMBER__OF_POSTS
+        )
+
+    def test_empty_cursor_page_has_no_links(self):
+        """Пустая страница за последним постом не ссылается назад
+        курсором, который пропустил бы этот пост."""
+        last = Post.objects.order_by('pub_date', 'id').first()
+        page = self.authorized_user.get(
+            reverse(self.URL_INDEX[0]) + f'?after={encode_cursor(last)}'
+        ).context['page_obj']
+        self.assertEqual(len(page), 0)
+        self.assertFalse(page.has_previous())
+        self.assertFalse(page.has_next())
+
 
 class FollowersTests(TestCase):
     @classmethod
@@ -245,6 +445,89 @@ class FollowersTests(TestCase):
         count_2 = Follow.objects.count()
         self.assertEqual(count_2, count_1 - 1)
 
+    def test_follow_index_reads_timeline(self):
+        """Лента подписок собирается при подписке и публикации
+        и очищается при отписке."""
+        url = reverse('posts:follow_index')
+        self.authorized_user.get(
+            reverse('posts:profile_follow', args=(self.author,))
+        )
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        response = self.authorized_user.get(url)
+        self.assertEqual(
+            list(response.context['page_obj']), [new_post, self.post]
+        )
+        Timeline.objects.all().delete()
+        call_command(
+            'rebuild_timelines', self.user.username, stdout=StringIO()
+        )
+        self.assertEqual(self.user.timeline.count(), 2)
+        self.authorized_user.get(
+            reverse('posts:profile_unfollow', args=(self.author,))
+        )
+        self.assertFalse(self.user.timeline.exists())
+
+    @override_settings(FEED_PULL_THRESHOLD=1)
+    def test_follow_index_merges_pulled_authors(self):
+        """Посты популярных авторов не раскладываются по лентам,
+        а подмешиваются при чтении."""
+        cache.clear()
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.user)
+        Post.objects.create(author=self.user, text='Из ленты')
+        self.authorized_user.get(
+            reverse('posts:profile_follow', args=(self.author,))
+        )
+        for i in range(settings.TOTAL_NUMBER_OF_POSTS_IN_PAGINATOR):
+            Post.objects.create(author=self.author, text=f'Пост {i}')
+        Follow.objects.create(user=self.user, author=reader)
+        Post.objects.create(author=reader, text='Из ленты')
+        self.assertFalse(
+            Timeline.objects.filter(post__author=self.author).exists()
+        )
+        expected = list(
+            Post.objects.filter(author__following__user=self.user)
+        )
+        url = reverse('posts:follow_index')
+        first_page = self.authorized_user.get(url).context['page_obj']
+        self.assertEqual(list(first_page), expected[:10])
+        second_page = self.authorized_user.get(
+            url + f'?after={first_page.next_cursor}'
+        ).context['page_obj']
+        self.assertEqual(list(second_page), expected[10:])
+        self.assertEqual(
+            metrics.snapshot()['feed.pull_threshold'], 1
+        )
+
+    @override_settings(FEED_PULL_THRESHOLD=2, TASKS_EAGER=False)
+    def test_follow_index_keeps_posts_after_author_drops_below_threshold(
+        self
+    ):
+        """Посты, вышедшие, пока автор был популярным, остаются в ленте
+        и после того, как подписчиков стало меньше порога."""
+        cache.clear()
+        reader = User.objects.create_user(username='reader')
+        for user in (self.user, reader):
+            Follow.objects.create(user=user, author=self.author)
+        post = Post.objects.create(author=self.author, text='Пока тянется')
+        while tasks.run_next('test'):
+            pass
+        Follow.objects.filter(user=reader).delete()
+        url = reverse('posts:follow_index')
+        for _ in range(2):
+            self.assertEqual(
+                list(self.authorized_user.get(url).context['page_obj']),
+                [post, self.post]
+            )
+            while tasks.run_next('test'):
+                pass
+        self.assertTrue(
+            Timeline.objects.filter(user=self.user, post=post).exists()
+        )
+        self.assertFalse(Counter.objects.filter(
+            scope=f'pushing:{self.author.pk}'
+        ).exists())
+
     def test_cant_follow_myself(self):
         """Невозможно подписаться на себя"""
         count_1 = Follow.objects.count()
@@ -270,3 +553,106 @@ class FollowersTests(TestCase):
             subscription
         count_2 = Follow.objects.count()
         self.assertEqual(count_2, count_1 + 1)
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        for i in range(settings.TOTAL_NUMBER_OF_POSTS_IN_PAGINATOR):
+            author = User.objects.create_user(username=f'author{i}')
+            Follow.objects.create(user=cls.user, author=author)
+            cls.post = Post.objects.create(
+                author=author, text=f'Пост {i}', group=cls.group
+            )
+            Comment.objects.create(
+                post=cls.post, author=author, text='Комментарий'
+            )
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text='Комментарий'
+            )
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_views_within_query_budget(self):
+        """Ленты и страница поста укладываются в бюджет запросов
+        независимо от числа постов и комментариев."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.post.author,)),
+            reverse('posts:post_detail', args=(self.post.id,)),
+            reverse('posts:post_comments', args=(self.post.id,)),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.authorized_client.get(url)
+                cache.clear()
+                self.assertWithinQueryBudget(self.authorized_client, url)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Красивые закаты над рекой'
+        )
+        cls.commented = Post.objects.create(author=cls.user, text='Фото')
+        Comment.objects.create(
+            post=cls.commented, author=cls.user, text='Какой красивый закат'
+        )
+        Post.objects.create(author=cls.user, text='Рассвет в горах')
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+
+    def search(self, query, **params):
+        response = self.guest_client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+        return list(response.context['page_obj'])
+
+    def test_search_finds_word_forms(self):
+        """Поиск находит другие формы слов в постах и комментариях,
+        посты с совпадением в тексте идут первыми."""
+        self.assertEqual(self.search('красивый закат'), [
+            self.post, self.commented
+        ])
+        self.assertEqual(self.search('рекой'), [self.post])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_search_index_follows_changes(self):
+        """Индекс обновляется при правке и удалении поста."""
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Облака'
+        post.save()
+        self.assertEqual(self.search('облако'), [post])
+        self.assertEqual(self.search('закаты'), [self.commented])
+        self.commented.delete()
+        self.assertEqual(self.search('закаты'), [])
+
+    @override_settings(NUMBER__OF_POSTS=2)
+    def test_search_pages(self):
+        """Результаты листаются по курсору без повторов."""
+        for i in range(3):
+            Post.objects.create(author=self.user, text=f'Закат номер {i}')
+        first = self.guest_client.get(
+            reverse('posts:search'), {'q': 'закат'}
+        ).context['page_obj']
+        self.assertTrue(first.has_next())
+        with self.assertNumQueries(2):
+            second = self.search('закат', after=first.next_cursor)
+        pages = list(first) + second
+        self.assertEqual(len(pages), len(set(pages)))
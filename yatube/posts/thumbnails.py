@@ -0,0 +1,355 @@
+import base64
+import hashlib
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+)
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from PIL import features
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from core import metrics
+from core.generations import bump_generation
+
+from . import cards
+
+logger = logging.getLogger(__name__)
+
+WIDTH, HEIGHT = 960, 339
+PLACEHOLDER_GEOMETRY = '16x6'
+PLACEHOLDER_OPTIONS = {'format': 'JPEG', 'quality': 30}
+FALLBACK_FORMAT = 'JPEG'
+MIME_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+
+_pool = None
+_pending = {}
+_lock = threading.Lock()
+
+
+class _Content:
+    """Исходник, переданный в процесс пула байтами."""
+
+    def __init__(self, content):
+        self.content = content
+
+    def read(self):
+        return self.content
+
+
+class _Captured:
+    """Миниатюра, собранная в процессе пула, до записи в хранилище."""
+    content = size = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def write(self, content):
+        self.content = content
+
+    def set_size(self, size):
+        self.size = size
+
+
+def render(content, name, geometry_string, options):
+    """Декодирует исходник и кодирует миниатюру.
+    Выполняется в процессе пула, без обращений к хранилищу и базе.
+    """
+    engine = default.engine
+    source_image = engine.get_image(_Content(content))
+    options = dict(options, image_info=engine.get_image_info(source_image))
+    thumbnail = _Captured(name)
+    try:
+        default.backend._create_thumbnail(
+            source_image, geometry_string, options, thumbnail
+        )
+        return (
+            thumbnail.content,
+            thumbnail.size,
+            engine.get_image_size(source_image)
+        )
+    finally:
+        engine.cleanup(source_image)
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            settings.THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup
+        )
+    return _pool
+
+
+def submit(source, thumbnail, geometry_string, options, post_id=None):
+    """Ставит миниатюру в очередь пула.
+    Повторная постановка той же миниатюры возвращает уже идущую задачу.
+    При THUMBNAIL_WORKERS = 0 миниатюра создаётся сразу.
+    """
+    with _lock:
+        if thumbnail.name in _pending:
+            return _pending[thumbnail.name]
+        future = _pending[thumbnail.name] = Future()
+    try:
+        content = source.read()
+    except Exception as error:
+        logger.warning('Исходник %s недоступен', source.name)
+        _finish(thumbnail, future, error=error)
+        return future
+    if settings.THUMBNAIL_WORKERS:
+        task = get_pool().submit(
+            render, content, thumbnail.name, geometry_string, options
+        )
+    else:
+        task = Future()
+        try:
+            task.set_result(
+                render(content, thumbnail.name, geometry_string, options)
+            )
+        except Exception as error:
+            task.set_exception(error)
+    task.add_done_callback(
+        lambda task: _store(thumbnail, task, future, post_id)
+    )
+    return future
+
+
+def _store(thumbnail, task, future, post_id):
+    """Записывает готовую миниатюру в хранилище.
+    В хранилище ключей она попадёт при следующем рендере,
+    поэтому здесь нет обращений к базе.
+    """
+    try:
+        content, size, _ = task.result()
+        thumbnail.write(content)
+        thumbnail.set_size(size)
+    except Exception as error:
+        logger.exception('Не удалось создать миниатюру %s', thumbnail.name)
+        _finish(thumbnail, future, error=error)
+        return
+    if post_id is not None:
+        cards.bump('post', post_id)
+        bump_generation('index_page')
+    _finish(thumbnail, future)
+
+
+def _finish(thumbnail, future, error=None):
+    with _lock:
+        _pending.pop(thumbnail.name, None)
+    if error is None:
+        future.set_result(thumbnail)
+    else:
+        future.set_exception(error)
+
+
+class QueuedThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl, который не создаёт миниатюры во время рендера.
+    Готовая миниатюра берётся из хранилища ключей, недостающая
+    ставится в пул процессов, а шаблон пока получает исходник.
+    """
+
+    def prepare(self, file_, geometry_string, **options):
+        """Исходник, миниатюра и полные опции, как их считает sorl."""
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return source, ImageFile(name, default.storage), options
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnail()')
+        thumbnail = self.ready(file_, geometry_string, **options)
+        return thumbnail or ImageFile(file_)
+
+    def ready(self, file_, geometry_string, **options):
+        """Готовая миниатюра или None, если она только поставлена в пул."""
+        source, thumbnail, options = self.prepare(
+            file_, geometry_string, **options
+        )
+        cached = default.kvstore.get(thumbnail)
+        if cached:
+            return cached
+        if thumbnail.exists():
+            default.kvstore.get_or_set(source)
+            default.kvstore.set(thumbnail, source)
+            return thumbnail
+        future = submit(
+            source, thumbnail, geometry_string, options,
+            getattr(getattr(file_, 'instance', None), 'pk', None)
+        )
+        if future.done() and future.exception() is None:
+            return future.result()
+        return None
+
+
+def formats():
+    """Форматы вариантов: WebP, если его умеет Pillow, и запасной JPEG."""
+    if features.check('webp'):
+        return ('WEBP', FALLBACK_FORMAT)
+    return (FALLBACK_FORMAT,)
+
+
+def variants():
+    """Геометрия и опции всех вариантов изображения поста:
+    несколько ширин в каждом формате и крошечная заглушка.
+    Маленькие изображения не растягиваются.
+    """
+    sizes = [
+        (f'{width}x{round(width * HEIGHT / WIDTH)}', {
+            'format': format_, 'upscale': False
+        })
+        for format_ in formats()
+        for width in settings.THUMBNAIL_WIDTHS
+    ]
+    return sizes + [(PLACEHOLDER_GEOMETRY, dict(PLACEHOLDER_OPTIONS))]
+
+
+def picture(image):
+    """Данные для <picture>: srcset по форматам, запасной src,
+    размеры и заглушка, которая видна, пока грузится картинка.
+    Ещё не созданные варианты пропускаются.
+    Возвращает данные и признак того, что готовы все варианты.
+    """
+    backend = default.backend
+    srcsets = {format_: [] for format_ in formats()}
+    placeholder = None
+    complete = True
+    for geometry, options in variants():
+        thumbnail = backend.ready(image, geometry, **options)
+        if thumbnail is None:
+            complete = False
+            continue
+        if geometry == PLACEHOLDER_GEOMETRY:
+            placeholder = 'data:image/jpeg;base64,' + base64.b64encode(
+                thumbnail.read()
+            ).decode()
+        else:
+            srcsets[options['format']].append(thumbnail)
+    fallback = srcsets.pop(FALLBACK_FORMAT)
+    largest = fallback[-1] if fallback else None
+    return {
+        'sources': [
+            {'type': MIME_TYPES[format_], 'srcset': _srcset(thumbnails)}
+            for format_, thumbnails in srcsets.items() if thumbnails
+        ],
+        'src': largest.url if largest else image.url,
+        'srcset': _srcset(fallback),
+        'width': largest.width if largest else None,
+        'height': largest.height if largest else None,
+        'sizes': settings.THUMBNAIL_SIZES,
+        'placeholder': placeholder,
+    }, complete
+
+
+def picture_key(name):
+    # Набор вариантов входит в ключ: смена настроек не отдаст старые URL.
+    signature = hashlib.md5(
+        repr((variants(), settings.THUMBNAIL_SIZES)).encode()
+    ).hexdigest()[:8]
+    return f'picture:{signature}:{name}'
+
+
+def resolve(images):
+    """Данные <picture> для всех изображений страницы по имени файла.
+    Готовые берутся из кэша одним get_many, без обращений к хранилищу
+    ключей sorl и к диску. Остальные собираются по вариантам
+    и кэшируются, когда созданы все варианты.
+    """
+    keys = {picture_key(image.name): image for image in images if image}
+    found = cache.get_many(keys)
+    pictures = {keys[key].name: value for key, value in found.items()}
+    missing = {}
+    for key, image in keys.items():
+        if key in found:
+            continue
+        pictures[image.name], complete = picture(image)
+        if complete:
+            missing[key] = pictures[image.name]
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_TIMEOUT)
+    metrics.incr('pictures.hits', len(found))
+    metrics.incr('pictures.misses', len(keys) - len(found))
+    return pictures
+
+
+def forget(name):
+    cache.delete(picture_key(name))
+
+
+def _srcset(thumbnails):
+    # Маленький исходник даёт одинаковые варианты: ширина в srcset одна.
+    widths = {}
+    for thumbnail in thumbnails:
+        widths.setdefault(thumbnail.width, thumbnail.url)
+    return ', '.join(f'{url} {width}w' for width, url in widths.items())
+
+
+def queue(image):
+    """Создаёт варианты изображения поста в фоне после коммита транзакции."""
+    if image:
+        transaction.on_commit(lambda: [
+            default.backend.ready(image, geometry, **options)
+            for geometry, options in variants()
+        ])
+
+
+def backfill(images):
+    """Создаёт недостающие варианты для изображений постов.
+    В пуле одновременно держится не больше нескольких задач на процесс.
+    Возвращает число созданных миниатюр и число ошибок.
+    """
+    window = max(settings.THUMBNAIL_WORKERS, 1) * 4
+    created = failed = 0
+    running = set()
+
+    def collect(done):
+        nonlocal created, failed
+        for future in done:
+            if future.exception() is None:
+                created += 1
+            else:
+                failed += 1
+
+    for image in images:
+        post_id = image.instance.pk
+        for geometry, options in variants():
+            source, thumbnail, options = default.backend.prepare(
+                image, geometry, **options
+            )
+            if thumbnail.exists():
+                continue
+            running.add(submit(source, thumbnail, geometry, options, post_id))
+            if len(running) >= window:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                collect(done)
+    collect(wait(running).done)
+    return created, failed
+
+
+def delete(source):
+    """Удаляет исходник, все его варианты и записи о них."""
+    for geometry, options in variants():
+        _, thumbnail, _ = default.backend.prepare(source, geometry, **options)
+        thumbnail.delete()
+    default.kvstore.delete_thumbnails(source)
+    default.kvstore.delete(source)
+    forget(source.name)
+    source.delete()
@@ -0,0 +1,375 @@
+import heapq
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CharField, F, Q, Value
+from django.db.models.functions import Cast, Concat
+from django.utils import timezone
+
+from core import metrics
+
+from . import counters
+from .models import Counter, Follow, Post, Timeline
+from .utils import seek_queryset
+
+
+def pulled_authors_key():
+    return f'feed:pulled_authors:{settings.FEED_PULL_THRESHOLD}'
+
+
+def recent_key(author_id):
+    return f'feed:recent:{author_id}'
+
+
+def pulled_author_ids():
+    """Авторы, у которых подписчиков не меньше FEED_PULL_THRESHOLD.
+    Их посты не раскладываются по лентам, а подмешиваются при чтении.
+    Автор, опустившийся ниже порога, подмешивается, пока его посты
+    не разложены по лентам подписчиков: это отмечает счётчик pushing.
+    """
+    authors = cache.get(pulled_authors_key())
+    if authors is None:
+        scopes = Counter.objects.filter(
+            Q(
+                scope__startswith='followers:',
+                value__gte=settings.FEED_PULL_THRESHOLD
+            )
+            | Q(scope__startswith='pushing:')
+        ).values_list('scope', flat=True)
+        authors = {int(name.split(':')[1]) for name in scopes}
+        cache.set(
+            pulled_authors_key(), authors, settings.FEED_PULLED_TIMEOUT
+        )
+        metrics.gauge('feed.pull_threshold', settings.FEED_PULL_THRESHOLD)
+        metrics.gauge('feed.pulled_authors', len(authors))
+    return authors
+
+
+def count_follower(author_id, delta):
+    """Сдвигает число подписчиков автора.
+    Переход через порог сбрасывает список тянущихся авторов.
+    Возвращает True, если автор опустился ниже порога: тогда
+    он помечен как раскладываемый и нужна задача push_author.
+    """
+    name = counters.scope('followers', author_id)
+    counters.change([name], delta)
+    followers = counters.get_count(
+        name, Follow.objects.filter(author_id=author_id)
+    )
+    threshold = settings.FEED_PULL_THRESHOLD
+    if followers != threshold and followers - delta != threshold:
+        return False
+    dropped = followers < threshold
+    if dropped:
+        Counter.objects.get_or_create(
+            scope=counters.scope('pushing', author_id)
+        )
+    cache.delete(pulled_authors_key())
+    return dropped
+
+
+def follower_batches(author_id):
+    """id подписчиков автора пачками по TIMELINE_BATCH_SIZE,
+    выбранными по ключу user_id."""
+    followers = Follow.objects.filter(author_id=author_id).order_by(
+        'user_id'
+    ).values_list('user_id', flat=True)
+    last = 0
+    while True:
+        batch = list(
+            followers.filter(user_id__gt=last)[:settings.TIMELINE_BATCH_SIZE]
+        )
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+def count_feed_posts(user_ids, delta):
+    counters.change(
+        [counters.scope('feed', user_id) for user_id in user_ids], delta
+    )
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора
+    и сдвигает счётчики их лент. Каждая пачка подписчиков - своя
+    транзакция, счётчик растёт только у тех, кому пост добавлен,
+    поэтому повтор задачи не считает пост дважды.
+    """
+    cache.delete(recent_key(post.author_id))
+    pulled = post.author_id in pulled_author_ids()
+    for batch in follower_batches(post.author_id):
+        with transaction.atomic():
+            if pulled:
+                # Пост подмешивается при чтении, но в счётчик входит.
+                count_feed_posts(batch, 1)
+                continue
+            present = set(Timeline.objects.filter(
+                post=post, user_id__in=batch
+            ).values_list('user_id', flat=True))
+            added = [user_id for user_id in batch if user_id not in present]
+            Timeline.objects.bulk_create(
+                Timeline(user_id=user_id, post=post, pub_date=post.pub_date)
+                for user_id in added
+            )
+            count_feed_posts(added, 1)
+
+
+def add_posts(posts):
+    """Раскладывает загруженные посты по лентам подписчиков авторов.
+    Посты тянущихся авторов подмешиваются при чтении.
+    """
+    pulled = pulled_author_ids()
+    by_author = defaultdict(list)
+    for post in posts:
+        by_author[post.author_id].append(post)
+    for author_id, author_posts in by_author.items():
+        cache.delete(recent_key(author_id))
+        if author_id in pulled:
+            continue
+        for batch in follower_batches(author_id):
+            Timeline.objects.bulk_create(
+                (
+                    Timeline(
+                        user_id=user_id, post_id=post.pk,
+                        pub_date=post.pub_date
+                    )
+                    for user_id in batch for post in author_posts
+                ),
+                batch_size=settings.TIMELINE_BATCH_SIZE,
+                ignore_conflicts=True
+            )
+
+
+def retract_post(post_id):
+    """Уменьшает счётчики лент, в которые пост был разложен.
+    Вызывается до удаления поста, пока его строки Timeline на месте:
+    в ленты, куда раскладка не дошла, пост и не считался.
+    """
+    Counter.objects.filter(
+        scope__in=Timeline.objects.filter(post_id=post_id).annotate(
+            name=Concat(
+                Value(counters.scope('feed', '')),
+                Cast('user_id', CharField())
+            )
+        ).values('name')
+    ).update(value=F('value') - 1)
+
+
+def retract(author_id):
+    """Уменьшает счётчики лент подписчиков после удаления поста
+    тянущегося автора: такой пост считается им без строк Timeline.
+    """
+    for batch in follower_batches(author_id):
+        count_feed_posts(batch, -1)
+
+
+def insert_posts(user_id, author_id, since=None):
+    posts = Post.objects.filter(author_id=author_id)
+    if since is not None:
+        posts = posts.filter(pub_date__gte=since)
+    Timeline.objects.bulk_create(
+        (
+            Timeline(user_id=user_id, post_id=post_id, pub_date=pub_date)
+            for post_id, pub_date in posts.values_list(
+                'id', 'pub_date'
+            ).iterator()
+        ),
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика все посты автора.
+    Посты раскладываемого автора добавляются сразу:
+    проход push_author мог уже миновать этого подписчика.
+    """
+    if author_id in pulled_author_ids() and not Counter.objects.filter(
+        scope=counters.scope('pushing', author_id)
+    ).exists():
+        return
+    insert_posts(user_id, author_id)
+
+
+def push_author(author_id):
+    """Раскладывает посты автора, опустившегося ниже порога,
+    по лентам всех подписчиков: опубликованные, пока он был
+    тянущимся, в Timeline не попали. До конца первого прохода
+    автор подмешивается при чтении. Посты, вышедшие за это время,
+    добавляет второй проход, когда их уже раскладывает fan_out.
+    """
+    started = timezone.now()
+    for since in (None, started):
+        for batch in follower_batches(author_id):
+            with transaction.atomic():
+                for user_id in batch:
+                    insert_posts(user_id, author_id, since)
+        if since is None:
+            Counter.objects.filter(
+                scope=counters.scope('pushing', author_id)
+            ).delete()
+            cache.delete(pulled_authors_key())
+
+
+def prune(user_id, author_id):
+    """Убирает посты автора из ленты бывшего подписчика."""
+    Timeline.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def rebuild(user_ids=None):
+    """Собирает ленты заново по текущим подпискам.
+    Лента каждого пользователя пересобирается в своей транзакции,
+    поэтому читатели видят её старой или новой, но не пустой.
+    Возвращает число обработанных подписок.
+    """
+    follows = Follow.objects.all()
+    timelines = Timeline.objects.all()
+    if user_ids is not None:
+        follows = follows.filter(user_id__in=user_ids)
+        timelines = timelines.filter(user_id__in=user_ids)
+    # Ленты тех, у кого подписок не осталось.
+    timelines.exclude(
+        user_id__in=Follow.objects.values('user_id')
+    ).delete()
+    users = follows.order_by('user_id').values_list(
+        'user_id', flat=True
+    ).distinct()
+    rebuilt = 0
+    last = 0
+    while True:
+        batch = list(
+            users.filter(user_id__gt=last)[:settings.TIMELINE_BATCH_SIZE]
+        )
+        if not batch:
+            return rebuilt
+        for user_id in batch:
+            with transaction.atomic():
+                Timeline.objects.filter(user_id=user_id).delete()
+                for author_id in Follow.objects.filter(
+                    user_id=user_id
+                ).values_list('author_id', flat=True):
+                    backfill(user_id, author_id)
+                    rebuilt += 1
+        last = batch[-1]
+
+
+def recent_posts(author_ids):
+    """Ключи (pub_date, id) последних FEED_RECENT_POSTS постов
+    каждого автора, от новых к старым.
+    """
+    keys = {author_id: recent_key(author_id) for author_id in author_ids}
+    cached = cache.get_many(keys.values())
+    recent = {}
+    for author_id, key in keys.items():
+        if key not in cached:
+            cached[key] = list(
+                Post.objects.filter(author_id=author_id).order_by(
+                    '-pub_date', '-id'
+                ).values_list('pub_date', 'id')[:settings.FEED_RECENT_POSTS]
+            )
+            cache.set(key, cached[key])
+        recent[author_id] = cached[key]
+    return recent
+
+
+def load_posts(ids):
+    """Посты с авторами и группами в порядке ids."""
+    posts = Post.objects.select_related('author', 'group').in_bulk(ids)
+    return [posts[pk] for pk in ids if pk in posts]
+
+
+class TimelineFeed:
+    """Лента подписок из Timeline. Сортировка и курсоры идут по
+    pub_date и post_id самой ленты, поэтому страница читается
+    диапазоном индекса (user, pub_date, post), без сортировки
+    через join с постами. Посты догружаются одним запросом по id.
+    """
+
+    def __init__(self, user):
+        self.rows = Timeline.objects.filter(user=user)
+
+    def count(self):
+        return self.rows.count()
+
+    def __getitem__(self, index):
+        ids = self.rows.order_by('-pub_date', '-post_id').values_list(
+            'post_id', flat=True
+        )[index]
+        if not isinstance(index, slice):
+            return load_posts([ids])[0]
+        return load_posts(list(ids))
+
+    def keys(self, key=None, newer=False, limit=None):
+        return list(
+            seek_queryset(self.rows, key, newer, pk='post_id').values_list(
+                'pub_date', 'post_id'
+            )[:limit]
+        )
+
+    def seek(self, key=None, newer=False, limit=None):
+        return load_posts([pk for _, pk in self.keys(key, newer, limit)])
+
+
+class MergedFeed:
+    """Лента подписок для тех, кто читает популярных авторов.
+    Посты из Timeline сливаются с недавними постами тянущихся
+    авторов k-путевым слиянием по (pub_date, id).
+    """
+
+    # Номерных страниц нет: каждый источник читается от ключа курсора.
+    keyset_only = True
+
+    def __init__(self, user, author_ids):
+        self.timeline = TimelineFeed(user)
+        self.author_ids = author_ids
+
+    def author_keys(self, author_id, recent, key, newer, limit):
+        if newer:
+            keys = [row for row in reversed(recent) if key < row]
+            complete = not recent or recent[-1] <= key
+        else:
+            keys = [row for row in recent if key is None or row < key]
+            complete = limit is not None and len(keys) >= limit
+        if complete or len(recent) < settings.FEED_RECENT_POSTS:
+            return keys[:limit]
+        posts = Post.objects.filter(author_id=author_id)
+        return list(
+            seek_queryset(posts, key, newer).values_list(
+                'pub_date', 'id'
+            )[:limit]
+        )
+
+    def seek(self, key=None, newer=False, limit=None):
+        metrics.incr('feed.pull_merges')
+        sources = [self.timeline.keys(key, newer, limit)]
+        for author_id, recent in recent_posts(self.author_ids).items():
+            sources.append(
+                self.author_keys(author_id, recent, key, newer, limit)
+            )
+        merged = heapq.merge(*sources, reverse=not newer)
+        ids = []
+        for _, pk in merged:
+            if limit is not None and len(ids) == limit:
+                break
+            if not ids or ids[-1] != pk:
+                ids.append(pk)
+        return load_posts(ids)
+
+
+def follow_feed(user):
+    """Лента подписок пользователя."""
+    pulled = pulled_author_ids()
+    author_ids = []
+    if pulled:
+        author_ids = list(Follow.objects.filter(
+            user=user, author_id__in=pulled
+        ).values_list('author_id', flat=True))
+    if not author_ids:
+        return TimelineFeed(user)
+    return MergedFeed(user, author_ids)
@@ -0,0 +1,411 @@
+import csv
+import datetime
+import json
+import os
+import time
+import zlib
+from itertools import islice
+
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.generations import bump_generation
+
+from . import counters, search, timeline
+from .models import Comment, Follow, Group, Post, User
+
+KINDS = ('posts', 'comments', 'follows')
+FORMATS = ('ndjson', 'csv')
+LOOKUP_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = {
+    'posts': (Post, {
+        'id': 'id',
+        'author': 'author__username',
+        'group': 'group__slug',
+        'text': 'text',
+        'pub_date': 'pub_date',
+        'image': 'image',
+    }),
+    'comments': (Comment, {
+        'id': 'id',
+        'post': 'post_id',
+        'author': 'author__username',
+        'text': 'text',
+        'created': 'created',
+    }),
+    'follows': (Follow, {
+        'id': 'id',
+        'user': 'user__username',
+        'author': 'author__username',
+    }),
+}
+
+
+def detect_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def read_ndjson(file, offset):
+    """Записи NDJSON-файла, начиная с байта offset,
+    вместе со смещением конца каждой записи.
+    """
+    file.seek(offset)
+    for line in file:
+        offset += len(line)
+        if line.strip():
+            yield json.loads(line), offset
+
+
+def read_csv(file, offset):
+    """Записи CSV-файла с заголовком, начиная с байта offset.
+    Заголовок всегда читается из начала файла.
+    """
+    file.seek(0)
+    header = file.readline()
+    columns = next(csv.reader([header.decode()]))
+    position = max(offset, len(header))
+    file.seek(position)
+
+    def lines():
+        nonlocal position
+        for line in file:
+            position += len(line)
+            yield line.decode()
+
+    for row in csv.reader(lines()):
+        if row:
+            yield dict(zip(columns, row)), position
+
+
+def parse_date(value):
+    if not value:
+        return timezone.now()
+    date = parse_datetime(value)
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def insert_raw(model, rows):
+    """Вставляет строки как есть, без pre_save полей, как loaddata:
+    у полей auto_now_add остаются даты из источника. Строки без id
+    вставляются по одной, чтобы узнать их id.
+    """
+    fields = model._meta.local_concrete_fields
+    with_pk = [row for row in rows if row.pk is not None]
+    size = max(connection.ops.bulk_batch_size(fields, with_pk), 1)
+    for start in range(0, len(with_pk), size):
+        model._base_manager._insert(
+            with_pk[start:start + size], fields=fields,
+            raw=True, ignore_conflicts=True
+        )
+    fields = [field for field in fields if field != model._meta.auto_field]
+    for row in rows:
+        if row.pk is None:
+            row.pk = model._base_manager._insert(
+                [row], fields=fields, return_id=True, raw=True
+            )
+
+
+class Lookup:
+    """Словарь имя -> id в памяти. Недостающие записи
+    создаются одним bulk_create на пачку.
+    """
+
+    def __init__(self, model, field, build):
+        self.model = model
+        self.field = field
+        self.build = build
+        self.ids = dict(model.objects.values_list(field, 'id').iterator())
+
+    def resolve(self, names):
+        missing = {name for name in names if name and name not in self.ids}
+        if missing:
+            self.model.objects.bulk_create(
+                [self.build(name) for name in missing],
+                ignore_conflicts=True
+            )
+            missing = list(missing)
+            for start in range(0, len(missing), LOOKUP_BATCH_SIZE):
+                self.ids.update(
+                    self.model.objects.filter(**{
+                        f'{self.field}__in':
+                            missing[start:start + LOOKUP_BATCH_SIZE]
+                    }).values_list(self.field, 'id')
+                )
+
+    def __getitem__(self, name):
+        return self.ids.get(name) if name else None
+
+
+def new_user(username):
+    user = User(username=username)
+    user.set_unusable_password()
+    return user
+
+
+def new_group(slug):
+    return Group(title=slug, slug=slug, description='')
+
+
+def existing_ids(model, ids):
+    found = set()
+    ids = list(ids)
+    for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+        found.update(
+            model.objects.filter(
+                pk__in=ids[start:start + LOOKUP_BATCH_SIZE]
+            ).values_list('pk', flat=True)
+        )
+    return found
+
+
+def optional_int(value):
+    return int(value) if value not in (None, '') else None
+
+
+class Importer:
+    """Потоковая загрузка постов, комментариев или подписок.
+    Файл читается по записи, пачки по batch_size строк вставляются
+    каждая в своей транзакции, вместе со строками лент и поискового
+    индекса для них. После пачки смещение в файле записывается
+    в checkpoint, и прерванная загрузка продолжается с него.
+    С id из источника повтор пачки ничего не дублирует.
+    """
+
+    def __init__(self, kind, path, format_=None, batch_size=5000,
+                 checkpoint=None, progress=None):
+        self.kind = kind
+        self.path = path
+        self.format = format_ or detect_format(path)
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.users = Lookup(User, 'username', new_user)
+        self.groups = Lookup(Group, 'slug', new_group)
+        self.imported = self.skipped = 0
+        self.offset = 0
+
+    def load_checkpoint(self):
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as file:
+                state = json.load(file)
+            self.offset = state['offset']
+            self.imported = state['imported']
+            self.skipped = state['skipped']
+
+    def save_checkpoint(self):
+        if not self.checkpoint:
+            return
+        temporary = self.checkpoint + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({
+                'offset': self.offset,
+                'imported': self.imported,
+                'skipped': self.skipped,
+            }, file)
+        os.replace(temporary, self.checkpoint)
+
+    def run(self):
+        """Загружает файл до конца. Возвращает число загруженных
+        и пропущенных строк.
+        """
+        self.load_checkpoint()
+        read = read_csv if self.format == 'csv' else read_ndjson
+        insert = getattr(self, f'insert_{self.kind}')
+        started = time.monotonic()
+        done = 0
+        with open(self.path, 'rb') as file:
+            records = read(file, self.offset)
+            while True:
+                batch = list(islice(records, self.batch_size))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    insert([record for record, _ in batch])
+                self.offset = batch[-1][1]
+                self.save_checkpoint()
+                done += len(batch)
+                if self.progress is not None:
+                    elapsed = time.monotonic() - started
+                    self.progress(self, done / elapsed if elapsed else 0)
+        reset_sequences()
+        # Ответы API сверяются по поколениям, и без пересчёта тоже.
+        bump_generation('index_page')
+        bump_generation('comments')
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        return self.imported, self.skipped
+
+    def count(self, rows, total):
+        self.imported += len(rows)
+        self.skipped += total - len(rows)
+
+    def insert(self, model, rows, total):
+        """Вставляет строки, которых ещё нет в базе, и возвращает их.
+        В imported попадают только они, а дубли и уже загруженные
+        строки считаются пропущенными.
+        """
+        unique = {}
+        for row in rows:
+            if row.pk is not None:
+                unique.setdefault(row.pk, row)
+        present = existing_ids(model, unique)
+        fresh = [row for pk, row in unique.items() if pk not in present]
+        rows = fresh + [row for row in rows if row.pk is None]
+        insert_raw(model, rows)
+        self.count(rows, total)
+        return rows
+
+    def insert_posts(self, records):
+        self.users.resolve(record.get('author') for record in records)
+        self.groups.resolve(record.get('group') for record in records)
+        posts = [
+            Post(
+                id=optional_int(record.get('id')),
+                author_id=self.users[record.get('author')],
+                group_id=self.groups[record.get('group')],
+                text=record.get('text') or '',
+                image=record.get('image') or '',
+                pub_date=parse_date(record.get('pub_date')),
+            )
+            for record in records
+        ]
+        for post in posts:
+            post.updated_at = post.pub_date
+        posts = self.insert(
+            Post,
+            [post for post in posts if post.author_id and post.text],
+            len(records)
+        )
+        search.index_posts((post.pk, post.text) for post in posts)
+        timeline.add_posts(posts)
+
+    def insert_comments(self, records):
+        self.users.resolve(record.get('author') for record in records)
+        posts = existing_ids(
+            Post, {optional_int(record.get('post')) for record in records}
+        )
+        comments = [
+            Comment(
+                id=optional_int(record.get('id')),
+                post_id=optional_int(record.get('post')),
+                author_id=self.users[record.get('author')],
+                text=record.get('text') or '',
+                created=parse_date(record.get('created')),
+            )
+            for record in records
+        ]
+        comments = self.insert(
+            Comment,
+            [
+                comment for comment in comments
+                if comment.post_id in posts
+                and comment.author_id and comment.text
+            ],
+            len(records)
+        )
+        search.index_comments(
+            (comment.pk, comment.post_id, comment.text)
+            for comment in comments
+        )
+
+    def insert_follows(self, records):
+        self.users.resolve(
+            name for record in records
+            for name in (record.get('user'), record.get('author'))
+        )
+        follows = [
+            Follow(
+                user_id=self.users[record.get('user')],
+                author_id=self.users[record.get('author')],
+            )
+            for record in records
+        ]
+        follows = {
+            (follow.user_id, follow.author_id): follow for follow in follows
+            if follow.user_id and follow.author_id
+            and follow.user_id != follow.author_id
+        }
+        present = set(Follow.objects.filter(
+            user_id__in={user_id for user_id, _ in follows},
+            author_id__in={author_id for _, author_id in follows},
+        ).values_list('user_id', 'author_id'))
+        follows = [
+            follow for pair, follow in follows.items() if pair not in present
+        ]
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        self.count(follows, len(records))
+        for follow in follows:
+            timeline.backfill(follow.user_id, follow.author_id)
+
+
+def reset_sequences():
+    """После вставки с явными id счётчики первичных ключей
+    (в PostgreSQL - последовательности) должны идти дальше них.
+    """
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), [Post, Comment, Follow]
+    )
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def rebuild_derived():
+    """Вставка пачками не шлёт сигналы, поэтому после загрузки
+    пересчитываются счётчики. Ленты и поиск дополняются
+    вместе с каждой пачкой.
+    """
+    counters.recount()
+    bump_generation('index_page')
+
+
+class ExportEncoder(DjangoJSONEncoder):
+    """Даты целиком, с микросекундами: DjangoJSONEncoder их обрезает."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def export_chunks(kind, after=0, chunk_size=EXPORT_CHUNK_SIZE, **filters):
+    """Записи в NDJSON пачками по chunk_size строк, в формате importdata.
+    filters сужают выборку, например до записей одного автора.
+    Пачки выбираются по ключу id > after, без OFFSET, и читаются
+    курсором. Вместе с пачкой отдаётся id её последней записи:
+    с него выгрузку можно продолжить.
+    """
+    model, fields = EXPORT_FIELDS[kind]
+    while True:
+        rows = model.objects.filter(pk__gt=after, **filters).order_by(
+            'pk'
+        ).values_list(*fields.values())[:chunk_size]
+        lines = []
+        for row in rows.iterator(chunk_size=chunk_size):
+            lines.append(json.dumps(
+                dict(zip(fields, row)),
+                cls=ExportEncoder,
+                ensure_ascii=False
+            ))
+            after = row[0]
+        if lines:
+            yield ('\n'.join(lines) + '\n').encode(), after
+        if len(lines) < chunk_size:
+            return
+
+
+def gzip_stream(chunks):
+    """Сжимает поток байтов в gzip на лету."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
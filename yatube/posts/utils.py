@@ -1,9 +1,233 @@
+import base64
+import binascii
+
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from . import counters
+from .models import Comment
+
+
+def encode_cursor(post):
+    """Непрозрачный курсор ленты: позиция поста в индексе (pub_date, id)."""
+    return encode_key(post.pub_date, post.pk)
+
+
+def encode_key(date, pk):
+    raw = f'{date.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор, для битого курсора возвращает None."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        pub_date, pk = raw.decode().split('|')
+        pub_date, pk = parse_datetime(pub_date), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if pub_date is None:
+        return None
+    return pub_date, pk
+
+
+class CursorPage:
+    """Страница ленты по курсору.
+    Не считает COUNT и не использует OFFSET,
+    шаблоны перебирают её так же, как обычную Page.
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage: {len(self)} posts>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def seek_queryset(queryset, key=None, newer=False, pk='id'):
+    """Посты старше ключа в порядке ленты,
+    а при newer - новее ключа в обратном порядке.
+    pk - поле, которое вместе с pub_date составляет ключ.
+    """
+    if key is not None:
+        pub_date, value = key
+        if newer:
+            queryset = queryset.filter(
+                Q(pub_date__gt=pub_date)
+                | Q(pub_date=pub_date, **{f'{pk}__gt': value})
+            )
+        else:
+            queryset = queryset.filter(
+                Q(pub_date__lt=pub_date)
+                | Q(pub_date=pub_date, **{f'{pk}__lt': value})
+            )
+    if newer:
+        return queryset.order_by('pub_date', pk)
+    return queryset.order_by('-pub_date', f'-{pk}')
+
+
+def seek(post_list, key=None, newer=False, limit=None):
+    """Первые limit постов от ключа.
+    Ленты, собираемые не одним запросом, реализуют метод seek сами.
+    """
+    if hasattr(post_list, 'seek'):
+        return post_list.seek(key, newer, limit)
+    return list(seek_queryset(post_list, key, newer)[:limit])
+
+
+def cursor_page(post_list, after=None, before=None):
+    per_page = settings.NUMBER__OF_POSTS
+    key = decode_cursor(before or after or '')
+    if key is None:
+        posts = seek(post_list, limit=per_page + 1)
+        next_cursor = (
+            encode_cursor(posts[per_page - 1])
+            if len(posts) > per_page else None
+        )
+        return CursorPage(posts[:per_page], next_cursor)
+    if before:
+        posts = seek(post_list, key, newer=True, limit=per_page + 1)
+        has_more = len(posts) > per_page
+        posts = posts[:per_page][::-1]
+        # У пустой страницы нет своей границы: курсор запроса
+        # исключил бы сам пост, на котором она стоит.
+        return CursorPage(
+            posts,
+            next_cursor=encode_cursor(posts[-1]) if posts else None,
+            previous_cursor=encode_cursor(posts[0]) if has_more else None,
+        )
+    posts = seek(post_list, key, limit=per_page + 1)
+    has_more = len(posts) > per_page
+    posts = posts[:per_page]
+    return CursorPage(
+        posts,
+        next_cursor=encode_cursor(posts[-1]) if has_more else None,
+        previous_cursor=encode_cursor(posts[0]) if posts else None,
+    )
+
+
+def comment_chunk(post_id, after=None):
+    """Очередные COMMENTS_PER_PAGE комментариев поста от старых к новым
+    и курсор следующей порции. Порция выбирается по индексу
+    (post, created, id) от ключа последнего показанного комментария.
+    """
+    per_page = settings.COMMENTS_PER_PAGE
+    comments = Comment.objects.filter(post_id=post_id)
+    key = decode_cursor(after or '')
+    if key is not None:
+        created, pk = key
+        comments = comments.filter(
+            Q(created__gt=created) | Q(created=created, id__gt=pk)
+        )
+    comments = comments.select_related('author').order_by('created', 'id')
+    comments = list(comments[:per_page + 1])
+    next_cursor = (
+        encode_key(comments[per_page - 1].created, comments[per_page - 1].pk)
+        if len(comments) > per_page else None
+    )
+    return comments[:per_page], next_cursor
+
+
+class CountedPaginator(Paginator):
+    """Пагинатор, который берёт число постов из счётчика области
+    вместо SELECT COUNT(*). Для больших лент число страниц
+    показывается примерно.
+    """
+
+    def __init__(self, object_list, per_page, scope, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.scope = scope
+
+    @cached_property
+    def count(self):
+        return counters.get_count(self.scope, self.object_list)
+
+    @property
+    def estimated(self):
+        return self.count >= settings.PAGINATOR_EXACT_COUNT_LIMIT
+
+
+class LimitPaginator(Paginator):
+    """Пагинатор без подсчёта записей.
+    О следующей странице узнаёт, выбирая на одну запись больше,
+    поэтому номер последней страницы ему неизвестен.
+    """
+    counted = False
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы не является числом')
+        if number < 1:
+            raise EmptyPage('Номер страницы меньше 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        posts = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not posts and number > 1:
+            raise EmptyPage('Страница не содержит записей')
+        has_next = len(posts) > self.per_page
+        posts = posts[:self.per_page]
+        self.__dict__['count'] = bottom + len(posts)
+        self.__dict__['num_pages'] = number + 1 if has_next else number
+        return self._get_page(posts, number, self)
+
+    def get_page(self, number):
+        """Как Paginator.get_page: нечисловой номер открывает первую
+        страницу, номер вне ленты - последнюю. Только для неё
+        записи считаются.
+        """
+        try:
+            return self.page(number)
+        except PageNotAnInteger:
+            return self.page(1)
+        except EmptyPage:
+            return self.page(
+                Paginator(self.object_list, self.per_page).num_pages
+            )
 
 
-def use_paginator(request, post_list):
-    paginator = Paginator(post_list, settings.NUMBER__OF_POSTS)
+def use_paginator(request, post_list, scope=None):
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if after or before or getattr(post_list, 'keyset_only', False):
+        return cursor_page(post_list, after=after, before=before)
+    if scope is None or not settings.PAGINATOR_COUNTERS:
+        paginator = LimitPaginator(post_list, settings.NUMBER__OF_POSTS)
+    else:
+        paginator = CountedPaginator(
+            post_list, settings.NUMBER__OF_POSTS, scope
+        )
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    page_obj.next_cursor = (
+        encode_cursor(page_obj[-1])
+        if page_obj.has_next() else None
+    )
     return page_obj
@@ -1,26 +1,45 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from core.decorators import query_budget
+from core.generations import cache_page_by_generation
 
+from . import cards, counters, search, thumbnails, timeline, transfer
+from .archive import Archive
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
-from .utils import use_paginator
+from .models import Counter, Follow, Group, Post, User
+from .utils import comment_chunk, use_paginator
 
 
-@cache_page(20, key_prefix="index_page")
+@cache_page_by_generation(settings.INDEX_CACHE_TIMEOUT, 'index_page')
+@query_budget(4)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = use_paginator(request, post_list)
+    post_list = Post.objects.select_related('author', 'group')
+    paginator = use_paginator(request, post_list, counters.scope('posts'))
     context = {
         'page_obj': paginator,
     }
     return render(request, 'posts/index.html', context)
 
 
+@query_budget(5)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = use_paginator(request, post_list)
+    post_list = group.posts.select_related('author', 'group')
+    paginator = use_paginator(
+        request, post_list, counters.scope('group', group.pk)
+    )
     context = {
         'group': group,
         'page_obj': paginator,
@@ -28,36 +47,132 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@query_budget(7)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    paginator = use_paginator(request, post_list)
+    post_list = author.posts.select_related('author', 'group')
+    paginator = use_paginator(
+        request, post_list, counters.scope('author', author.pk)
+    )
     following = (
         request.user.is_authenticated
         and author.following.filter(
             user=request.user,
-        )
+        ).exists()
     )
     context = {
         'author': author,
         'page_obj': paginator,
         'following': following,
+        'counts': counters.user_counts(author.pk),
     }
     return render(request, 'posts/profile.html', context)
 
 
+def post_etag(request, post_id):
+    """ETag страницы поста из одного запроса и одного обращения к кэшу.
+    updated_at меняется при правке поста, его комментариев и их
+    авторов, версии карточек - при смене автора, группы или картинки.
+    Страница зависит от того, кто смотрит, а форма комментария -
+    от CSRF-куки, поэтому они тоже входят в ETag.
+    """
+    row = Post.objects.filter(pk=post_id).annotate(
+        author_posts=Subquery(
+            Counter.objects.filter(
+                scope=Concat(
+                    Value(counters.scope('author', '')),
+                    Cast(OuterRef('author_id'), CharField())
+                )
+            ).values('value')[:1]
+        )
+    ).values_list('updated_at', 'author_id', 'group_id', 'author_posts')
+    row = row.first()
+    if row is None:
+        return None
+    updated_at, author_id, group_id, author_posts = row
+    keys = [
+        cards.version_key('post', post_id),
+        cards.version_key('user', author_id),
+        cards.version_key('group', group_id),
+    ]
+    versions = cache.get_many(keys)
+    parts = [
+        updated_at.isoformat(), author_posts,
+        *(versions.get(key) for key in keys),
+    ]
+    if request.user.is_authenticated:
+        parts += [
+            request.user.pk,
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+        ]
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def private_page(view):
+    """Ответ хранит только браузер, сверяя его по ETag."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        patch_vary_headers(response, ('Cookie',))
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    return wrapper
+
+
+@query_budget(6)
+@private_page
+@condition(etag_func=post_etag)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'group'), pk=post_id
+    )
     form = CommentForm()
-    comments = post.comments.all()
+    comments, next_cursor = comment_chunk(post.pk)
     context = {
         'post': post,
         'form': form,
         'comments': comments,
+        'next_cursor': next_cursor,
+        'author_posts_count': counters.get_count(
+            counters.scope('author', post.author_id), post.author.posts.all()
+        ),
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@query_budget(4)
+@private_page
+@condition(etag_func=post_etag)
+def post_comments(request, post_id):
+    """Следующая порция комментариев поста готовым HTML-фрагментом
+    для кнопки «Показать ещё».
+    """
+    comments, next_cursor = comment_chunk(
+        post_id, request.GET.get('after')
+    )
+    if not comments and not Post.objects.filter(pk=post_id).exists():
+        raise Http404('Пост не найден')
+    context = {
+        'post_id': post_id,
+        'comments': comments,
+        'next_cursor': next_cursor,
+    }
+    return render(request, 'includes/comments.html', context)
+
+
+@query_budget(4)
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'page_obj': (
+            search.search_page(query, request.GET.get('after'))
+            if query else None
+        ),
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(
@@ -68,6 +183,7 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         form.save()
+        thumbnails.queue(post.image)
         return redirect('posts:profile', post.author)
 
     return render(
@@ -90,7 +206,8 @@ def post_edit(request, post_id):
         instance=post
     )
     if form.is_valid():
-        form.save()
+        post = form.save()
+        thumbnails.queue(post.image)
         return redirect(
             'posts:post_detail', post_id
         )
@@ -115,11 +232,14 @@ def add_comment(request, post_id):
 
 
 @login_required
+@query_budget(6)
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
+    posts = timeline.follow_feed(request.user)
     context = {
         'follow': True,
-        'page_obj': use_paginator(request, posts),
+        'page_obj': use_paginator(
+            request, posts, counters.scope('feed', request.user.pk)
+        ),
     }
     return render(request, 'posts/follow.html', context)
 
@@ -138,3 +258,48 @@ def profile_unfollow(request, username):
         user=request.user, author__username=username
     ).delete()
     return redirect('posts:profile', username=username)
+
+
+@staff_member_required
+def export_data(request, kind):
+    """Потоковая выгрузка в NDJSON, ?gzip=1 сжимает её на лету.
+    Оборванную выгрузку продолжает ?after=<id последней полученной записи>.
+    """
+    if kind not in transfer.KINDS:
+        raise Http404
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
+    chunks = (
+        chunk for chunk, _ in transfer.export_chunks(kind, after)
+    )
+    filename = f'{kind}.ndjson'
+    content_type = 'application/x-ndjson'
+    if request.GET.get('gzip'):
+        chunks = transfer.gzip_stream(chunks)
+        filename += '.gz'
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+def profile_archive(request, username):
+    """Архив своих постов, комментариев и картинок одним ZIP."""
+    if username != request.user.username:
+        return redirect('posts:profile', username)
+    archive = Archive.start(request.user)
+    if archive is None:
+        response = HttpResponse(
+            'Сейчас собирается слишком много архивов, попробуйте позже',
+            status=503
+        )
+        response['Retry-After'] = 60
+        return response
+    response = StreamingHttpResponse(archive, content_type='application/zip')
+    response['Content-Disposition'] = (
+        f'attachment; filename="{username}.zip"'
+    )
+    return response
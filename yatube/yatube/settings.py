@@ -4,8 +4,40 @@ LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
 
 NUMBER__OF_POSTS = 10
+COMMENTS_PER_PAGE = 50
 TOTAL_NUMBER_OF_POSTS_IN_PAGINATOR = 13
 NUMBER_OF_SUBSCRIPTIONS = 5
+PAGINATOR_COUNTERS = True
+PAGINATOR_EXACT_COUNT_LIMIT = 10000
+PAGINATOR_WINDOW = 2
+TIMELINE_BATCH_SIZE = 500
+FEED_PULL_THRESHOLD = 10000
+FEED_PULLED_TIMEOUT = 60
+FEED_RECENT_POSTS = 200
+POST_CARD_TIMEOUT = 60 * 60 * 24
+INDEX_CACHE_TIMEOUT = 60 * 60 * 6
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_WIDTHS = (320, 640, 960)
+THUMBNAIL_SIZES = '(max-width: 960px) 100vw, 960px'
+THUMBNAIL_BACKEND = 'posts.thumbnails.QueuedThumbnailBackend'
+TASKS_EAGER = False
+TASK_WORKERS = 2
+TASK_RETRY_DELAY = 10
+TASK_TIMEOUT = 60 * 10
+TASK_SCHEDULE = {
+    'posts.tasks.sweep_media': 60 * 60 * 24,
+}
+ARCHIVE_MAX_JOBS = 2
+MEDIA_DELETE_GRACE = 60 * 10
+UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+IMAGE_MAX_PIXELS = 50 * 1000 * 1000
+IMAGE_MAX_SIDE = 1920
+IMAGE_QUALITY = 85
+FILE_UPLOAD_HANDLERS = [
+    'core.uploads.SizeLimitUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -14,10 +46,23 @@ SECRET_KEY = '8#0&cy@mq)e0z%smef6ugp38i!t$*87985z!q(n))ko^um-9)('
 DEBUG = True
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.TwoTierCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'L1_MAX_BYTES': 16 * 1024 * 1024,
+            'L1_TIMEOUT': 5,
+            'POLL_INTERVAL': 0.5,
+            'SHARED_ONLY_PREFIXES': ('metrics:',),
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+    },
 }
 
+TEST_RUNNER = 'core.testing.TestRunner'
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 ALLOWED_HOSTS = [
@@ -35,6 +80,7 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'core.apps.CoreConfig',
     'about.apps.AboutConfig',
+    'api.apps.ApiConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',